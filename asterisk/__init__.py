@@ -5,10 +5,24 @@ asterisk with python:
 
 agi     - python wrapper for agi
 agitb   - a module to assist in agi debugging, like cgitb
+actions - classes for manager actions
 config  - a module for parsing asterisk config files
 manager - a module for interacting with the asterisk manager interface
+metrics - instrumentation of the manager
+peers - cache of the SIP peers of an asterisk
+recorder - recording and replaying manager traffic
+asyncmanager - an asyncio variant of the manager module
+campaign - paced bulk originating of calls
+channels - live table of the channels of an asterisk
+cluster - many asterisk nodes behind one facade
+dispatch - parallel dispatching of manager events
+framing - splits the manager protocol into messages
+eventqueue - bounded queues for the manager threads
+eventstream - consuming manager events by iteration
+fakeserver - a stand-in for the asterisk manager interface
+multiproc - dispatching manager events to worker processes
 
 """
 
-__all__ = ['agi', 'agitb', 'config', 'manager']
+__all__ = ['actions', 'agi', 'agitb', 'asyncmanager', 'campaign', 'channels', 'cluster', 'config', 'dispatch', 'eventqueue', 'eventstream', 'fakeserver', 'framing', 'manager', 'metrics', 'multiproc', 'peers', 'recorder']
 __version__ = '0.4.2'
@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+# vim: set expandtab shiftwidth=4:
+
+"""
+Classes for manager actions
+
+An action class knows the headers of its action.  The fields are checked
+and encoded once when the action is created, sending it only adds the
+ActionID line:
+
+   import asterisk.actions
+   import asterisk.manager
+
+   manager = asterisk.manager.Manager()
+   manager.connect('host')
+   manager.login('user', 'secret')
+
+   action = asterisk.actions.Originate(
+      channel='SIP/100', exten='200', context='default', priority=1,
+      variables={'CAMPAIGN': 'spring'})
+   response = manager.send(action)
+
+An action may be sent many times, each time with a new ActionID unless
+action_id is given.  send answers list actions like Status with an
+EventList.  send_action, submit_action and the list action methods of the
+Manager accept actions in place of a dictionary as well.
+
+More actions are defined by subclassing Action:
+
+   class MuteAudio(asterisk.actions.Action):
+      name = 'MuteAudio'
+      fields = (
+         asterisk.actions.Field('channel', 'Channel', required=True),
+         asterisk.actions.Field('direction', 'Direction', required=True),
+         asterisk.actions.Field('state', 'State', required=True),
+      )
+
+Actions are not meant to be changed after creation, changed attributes
+are not sent.  Values are sent as str(value), they may not contain line
+breaks.  Fields left at None (or an empty string) are not sent.  A list
+value is sent as one header per item, a dictionary as one 'key=value'
+header per item, like the Variable headers of Originate.
+"""
+
+
+class Field(object):
+    """A header of an action, set by the keyword argument attr"""
+
+    def __init__(self, attr, header, required=False, default=None):
+        self.attr = attr
+        self.header = header
+        self.required = required
+        self.default = default
+
+
+def _add(parts, prefix, value):
+    """Add the headers of a value that is not a string"""
+
+    if isinstance(value, dict):
+        value = ["%s=%s" % item for item in value.items()]
+    if isinstance(value, (list, tuple)):
+        for item in value:
+            parts.append("%s%s" % (prefix, item))
+    else:
+        parts.append("%s%s" % (prefix, value))
+
+
+def _body(action, parts):
+    """Join and encode the headers, checking the values for line breaks"""
+
+    parts.append("\r\n")
+    body = "\r\n".join(parts)
+    # each header adds exactly one line break, more come from values
+    if body.count("\n") != len(parts) or body.count("\r") != len(parts):
+        raise ValueError("line break in a header value of %r" % action)
+    return body.encode()
+
+
+class Action(object):
+    """
+    Base of the action classes
+
+    name is the Action header, fields the list of Fields.  list_action
+    marks actions answered by an EventList.  The fields are passed to
+    __init__ as keyword arguments, the __init__ of a subclass passes them
+    on to Action.__init__.
+    """
+
+    name = None
+    fields = ()
+    list_action = False
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if cls.name is None:
+            return
+        cls._prefix = ("Action: %s\r\nActionID: " % cls.name).encode()
+        # (attr, header prefix, required, default) of the fields
+        cls._headers = tuple(
+            (field.attr, "%s: " % field.header, field.required, field.default)
+            for field in cls.fields
+        )
+
+    def __init__(self, *, action_id=None, **kwargs):
+        if self.name is None:
+            raise TypeError("Action is abstract, use a subclass")
+        self.action_id = action_id
+        parts = []
+        for attr, prefix, required, default in self._headers:
+            value = kwargs.pop(attr, default)
+            setattr(self, attr, value)
+            if type(value) is str:
+                if value:
+                    parts.append(prefix + value)
+                    continue
+            elif value is not None:
+                _add(parts, prefix, value)
+                continue
+            if required:
+                raise ValueError("%s needs %s" % (type(self).__name__, attr))
+        if kwargs:
+            raise TypeError(
+                "%s got unknown fields %s" % (type(self).__name__, ", ".join(sorted(kwargs)))
+            )
+        self._body = _body(self, parts)
+
+    def encode(self, action_id):
+        """Return the action as bytes to send, with the ActionID action_id"""
+        action_id = str(action_id)
+        if "\n" in action_id or "\r" in action_id:
+            raise ValueError("line break in ActionID %r" % action_id)
+        return b"%s%s\r\n%s" % (self._prefix, action_id.encode(), self._body)
+
+    def __repr__(self):
+        values = ", ".join(
+            "%s=%r" % (field.attr, getattr(self, field.attr))
+            for field in self.fields
+            if getattr(self, field.attr) not in (None, "")
+        )
+        return "<%s %s>" % (type(self).__name__, values)
+
+
+class Login(Action):
+    name = "Login"
+    fields = (
+        Field("username", "Username", required=True),
+        Field("secret", "Secret", required=True),
+    )
+
+
+class Logoff(Action):
+    name = "Logoff"
+
+
+class Ping(Action):
+    name = "Ping"
+
+
+class Events(Action):
+    name = "Events"
+    fields = (Field("event_mask", "EventMask", required=True),)
+
+
+class Filter(Action):
+    name = "Filter"
+    fields = (
+        Field("operation", "Operation", default="Add"),
+        Field("filter", "Filter", required=True),
+    )
+
+
+class Hangup(Action):
+    name = "Hangup"
+    fields = (
+        Field("channel", "Channel", required=True),
+        Field("cause", "Cause"),
+    )
+
+
+class Status(Action):
+    name = "Status"
+    fields = (Field("channel", "Channel"),)
+    list_action = True
+
+
+class CoreShowChannels(Action):
+    name = "CoreShowChannels"
+    list_action = True
+
+
+class QueueStatus(Action):
+    name = "QueueStatus"
+    fields = (
+        Field("queue", "Queue"),
+        Field("member", "Member"),
+    )
+    list_action = True
+
+
+class DBGetTree(Action):
+    name = "DBGetTree"
+    fields = (
+        Field("family", "Family"),
+        Field("key", "Key"),
+    )
+    list_action = True
+
+
+class Redirect(Action):
+    name = "Redirect"
+    fields = (
+        Field("channel", "Channel", required=True),
+        Field("exten", "Exten", required=True),
+        Field("priority", "Priority", required=True, default="1"),
+        Field("context", "Context"),
+        Field("extra_channel", "ExtraChannel"),
+    )
+
+
+class Originate(Action):
+    name = "Originate"
+    fields = (
+        Field("channel", "Channel", required=True),
+        Field("exten", "Exten"),
+        Field("context", "Context"),
+        Field("priority", "Priority"),
+        Field("application", "Application"),
+        Field("data", "Data"),
+        Field("timeout", "Timeout"),
+        Field("caller_id", "CallerID"),
+        Field("account", "Account"),
+        Field("asynchronously", "Async"),
+        Field("variables", "Variable"),
+    )
+
+
+class MailboxStatus(Action):
+    name = "MailboxStatus"
+    fields = (Field("mailbox", "Mailbox", required=True),)
+
+
+class MailboxCount(Action):
+    name = "MailboxCount"
+    fields = (Field("mailbox", "Mailbox", required=True),)
+
+
+class Command(Action):
+    name = "Command"
+    fields = (Field("command", "Command", required=True),)
+
+
+class ExtensionState(Action):
+    name = "ExtensionState"
+    fields = (
+        Field("exten", "Exten", required=True),
+        Field("context", "Context", required=True),
+    )
+
+
+class PlayDTMF(Action):
+    name = "PlayDTMF"
+    fields = (
+        Field("channel", "Channel", required=True),
+        Field("digit", "Digit", required=True),
+    )
+
+
+class AbsoluteTimeout(Action):
+    name = "AbsoluteTimeout"
+    fields = (
+        Field("channel", "Channel", required=True),
+        Field("timeout", "Timeout", required=True),
+    )
+
+
+class Sippeers(Action):
+    name = "Sippeers"
+    list_action = True
+
+
+class SIPshowpeer(Action):
+    name = "SIPshowpeer"
+    fields = (Field("peer", "Peer", required=True),)
+
+
+class ControlPlayback(Action):
+    name = "ControlPlayback"
+    fields = (
+        Field("channel", "Channel", required=True),
+        Field("control", "Control", required=True),
+    )
+
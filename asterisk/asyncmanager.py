@@ -0,0 +1,358 @@
+#!/usr/bin/env python
+# vim: set expandtab shiftwidth=4:
+
+"""
+asyncio Interface for Asterisk Manager
+
+This module provides AsyncManager, a single threaded variant of
+asterisk.manager.Manager running on an asyncio event loop.  Many
+connections and many outstanding actions can share one loop; responses
+are matched to their actions by ActionID.
+
+   import asyncio
+   import asterisk.asyncmanager
+
+   async def handle_event(event, manager):
+      print("Recieved event: %s" % event.name)
+
+   async def main():
+      manager = asterisk.asyncmanager.AsyncManager()
+      try:
+         await manager.connect('host')
+         await manager.login('user', 'secret')
+
+         # callbacks may be plain functions or coroutine functions
+         manager.register_event('*', handle_event)
+
+         response = await manager.status()
+      finally:
+         await manager.close()
+
+   asyncio.run(main())
+
+The action helpers are the ones of asterisk.manager.Manager, they return
+awaitables here.
+"""
+
+import asyncio
+import inspect
+import socket
+from collections import Counter
+
+from asterisk import actions
+from asterisk.dispatch import DispatchTable
+from asterisk.framing import FrameParser, RECV_SIZE, has_action_id, peek_event
+from asterisk.manager import (
+    Event,
+    ManagerActions,
+    ManagerAuthException,
+    ManagerException,
+    ManagerMsg,
+    ManagerSocketException,
+    _ListCollector,
+)
+
+
+class AsyncManager(ManagerActions):
+    """
+    asyncio interface to the asterisk manager
+
+    See Manager for drop_unsubscribed and dropped_events.
+    """
+
+    def __init__(self, drop_unsubscribed=True):
+        self._reader = None
+        self._writer = None
+        self.title = None  # set by received greeting
+        self.version = None
+        self._connected = False
+
+        # our hostname
+        self.hostname = socket.gethostname()
+
+        # callbacks for events, replaced on every change
+        self._dispatch_table = DispatchTable()
+        self._drop_unsubscribed = drop_unsubscribed
+        self.dropped_events = Counter()
+
+        # futures of actions waiting for a response, by ActionID
+        self._pending = {}
+        # collectors of list actions, by ActionID
+        self._lists = {}
+        self._greeting = None
+
+        self._event_queue = None
+        self._seq = 0
+
+        # some tasks
+        self._receive_task = None
+        self._dispatch_task = None
+
+    def connected(self):
+        """
+        Check if we are connected or not.
+        """
+        return self._connected
+
+    def next_seq(self):
+        """Return the next number in the sequence, this is used for ActionID"""
+        try:
+            return self._seq
+        finally:
+            self._seq += 1
+
+    def new_action_id(self):
+        """Return a new ActionID, for actions that need it before sending"""
+        return "%s-%08x" % (self.hostname, self.next_seq())
+
+    async def send_action(self, cdict={}, **kwargs):
+        """
+        Send a command to the manager and wait for its response
+
+        See Manager.send_action for the format of cdict.
+        """
+
+        name, action_id, data = self._prepare_action(cdict, kwargs)
+        return await self._send(action_id, data)
+
+    async def _send(self, action_id, data):
+        """Send the bytes of an action and wait for its response"""
+
+        if not self._connected:
+            raise ManagerException("Not connected")
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending[action_id] = future
+        try:
+            self._writer.write(data)
+            await self._writer.drain()
+            return await future
+        except (ConnectionError, OSError) as e:
+            raise ManagerSocketException(e.errno, e.strerror)
+        finally:
+            self._pending.pop(action_id, None)
+
+    async def send_actions(self, actions):
+        """
+        Send many actions in one write and wait for all responses
+
+        Returns the list of the responses, see Manager.send_actions.
+        """
+
+        if not self._connected:
+            raise ManagerException("Not connected")
+
+        prepared = [self._prepare_action(action, {}) for action in actions]
+        loop = asyncio.get_running_loop()
+        futures = []
+        try:
+            for name, action_id, data in prepared:
+                if action_id in self._pending:
+                    raise ManagerException("Duplicate ActionID %s" % action_id)
+                future = self._pending[action_id] = loop.create_future()
+                futures.append(future)
+            self._writer.write(b"".join(item[2] for item in prepared))
+            await self._writer.drain()
+            return await asyncio.gather(*futures)
+        except (ConnectionError, OSError) as e:
+            raise ManagerSocketException(e.errno, e.strerror)
+        finally:
+            for name, action_id, data in prepared[:len(futures)]:
+                self._pending.pop(action_id, None)
+
+    async def send_list_action(self, cdict={}, **kwargs):
+        """
+        Send a list-style action and collect its events
+
+        See Manager.send_list_action.
+        """
+
+        name, action_id, data = self._prepare_action(cdict, kwargs)
+        collector = _ListCollector()
+        self._lists[action_id] = collector
+        try:
+            if not collector.response(await self._send(action_id, data)):
+                return await asyncio.wrap_future(collector.future)
+            return collector.future.result()
+        finally:
+            self._lists.pop(action_id, None)
+
+    def _handle_event(self, event):
+        """Hand an event to its list action or to the event dispatcher"""
+
+        collector = self._lists.get(event.peek_header("ActionID"))
+        if collector is not None:
+            collector.event(event)
+        else:
+            self._event_queue.put_nowait(event)
+
+    def _handle_frame(self, frame):
+        """Route a frame to the event queue or its waiting action"""
+
+        # events are parsed when their headers are accessed
+        name = peek_event(frame)
+        if name is not None:
+            if (
+                self._drop_unsubscribed
+                and not self._dispatch_table.callbacks(name)
+                and not has_action_id(frame)
+            ):
+                self.dropped_events[name] += 1
+                return
+            self._handle_event(Event(ManagerMsg.from_frame(frame), name))
+            return
+
+        message = ManagerMsg.from_frame(frame)
+        if message.has_header("Event"):
+            self._handle_event(Event(message))
+        elif message.has_header("Response"):
+            future = self._pending.pop(message.get_header("ActionID"), None)
+            # some commands do not return the ActionID, hand those to
+            # the oldest action still waiting
+            if future is None and not message.has_header("ActionID"):
+                for action_id in self._pending:
+                    future = self._pending.pop(action_id)
+                    break
+            if future is not None and not future.done():
+                future.set_result(message)
+        else:
+            print("No clue what we got\n{}".format(message.data))
+
+    async def _receive_data(self):
+        """
+        Read messages until the connection is closed.
+        """
+
+        parser = FrameParser()
+        try:
+            while True:
+                data = await self._reader.read(RECV_SIZE)
+                if not data:
+                    # EOF during reading
+                    break
+                frames = parser.feed(data)
+                if self.title is None and parser.title is not None:
+                    # store the title and version of the manager we are
+                    # connecting to:
+                    self.title = parser.title
+                    self.version = parser.version
+                for frame in frames:
+                    # the first message is the greeting
+                    if not self._greeting.done():
+                        self._greeting.set_result(ManagerMsg.from_frame(frame))
+                    else:
+                        self._handle_frame(frame)
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self._connected = False
+            self._writer.close()
+            error = ManagerSocketException(0, "Connection Terminated")
+            if not self._greeting.done():
+                self._greeting.set_exception(error)
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(error)
+            self._pending.clear()
+            for collector in self._lists.values():
+                collector.fail(error)
+            # notify the dispatcher
+            self._event_queue.put_nowait(None)
+
+    def register_event(self, event, function):
+        """
+        Register a callback for the specfied event.
+        The callback may be a coroutine function.
+        If a callback function returns True, no more callbacks for that
+        event will be executed.  See Manager.register_event for patterns.
+        """
+
+        self._dispatch_table = self._dispatch_table.register(event, function)
+
+    def unregister_event(self, event, function):
+        """
+        Unregister a callback for the specified event.
+        """
+        self._dispatch_table = self._dispatch_table.unregister(event, function)
+
+    async def _event_dispatch(self):
+        """This task is responsible for dispatching events"""
+
+        loop = asyncio.get_running_loop()
+        while True:
+            ev = await self._event_queue.get()
+
+            # if we got None as an event, we are finished
+            if ev is None:
+                break
+
+            for callback in self._dispatch_table.callbacks(ev.name):
+                # a failing callback must not end event dispatching
+                try:
+                    result = callback(ev, self)
+                    if inspect.isawaitable(result):
+                        result = await result
+                except Exception as e:
+                    loop.call_exception_handler({
+                        "message": "Exception in event callback %r" % (callback,),
+                        "exception": e,
+                    })
+                    continue
+                if result:
+                    break
+
+    async def connect(self, host, port=5038):
+        """Connect to the manager interface"""
+
+        if self._connected:
+            raise ManagerException("Already connected to manager")
+
+        try:
+            self._reader, self._writer = await asyncio.open_connection(host, int(port))
+        except OSError as e:
+            raise ManagerSocketException(e.errno, e.strerror)
+
+        loop = asyncio.get_running_loop()
+        self._connected = True
+        self._greeting = loop.create_future()
+        self._event_queue = asyncio.Queue()
+        self._receive_task = loop.create_task(self._receive_data())
+        self._dispatch_task = loop.create_task(self._event_dispatch())
+
+        # get our initial connection response
+        return await self._greeting
+
+    async def close(self):
+        """Shutdown the connection to the manager"""
+
+        # if we are still connected, logout
+        if self._connected:
+            try:
+                await self.logoff()
+            except ManagerException:
+                pass
+
+        if self._receive_task is not None:
+            # asterisk closes the connection after Logoff, do not wait
+            # forever for a misbehaving server
+            try:
+                await asyncio.wait_for(asyncio.shield(self._receive_task), 1)
+            except asyncio.TimeoutError:
+                self._receive_task.cancel()
+            self._receive_task = None
+
+        if self._dispatch_task is not None:
+            # do not wait for ourself (when close is called from event handlers)
+            if self._dispatch_task is not asyncio.current_task():
+                await self._dispatch_task
+            self._dispatch_task = None
+
+    async def login(self, username, secret):
+        """Login to the manager, throws ManagerAuthException when login falis"""
+
+        response = await self.send(actions.Login(username=username, secret=secret))
+
+        if response.get_header("Response") == "Error":
+            raise ManagerAuthException(response.get_header("Message"))
+
+        return response
@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+# vim: set expandtab shiftwidth=4:
+
+"""
+Paced bulk originating of calls
+
+A Campaign originates a series of calls through a Manager, no faster
+than a given rate and with at most a given number of calls up at once.
+Every call is followed through its OriginateResponse (matched by
+ActionID) and its Hangup (matched by Uniqueid), each has a future that
+is resolved when the call is over:
+
+   import asterisk.manager
+   import asterisk.campaign
+
+   manager = asterisk.manager.Manager()
+   manager.connect('host')
+   manager.login('user', 'secret')
+
+   calls = ({'Channel': 'SIP/trunk/%s' % number, 'Context': 'campaign',
+             'Exten': 's', 'Priority': 1, 'Timeout': 30000}
+            for number in numbers)
+   campaign = asterisk.campaign.Campaign(manager, calls, rate=5, max_active=50)
+   campaign.start()
+   print(campaign.wait())
+
+A call spec is a dictionary of the headers of the Originate action, it is
+always sent with Async.  A place of the max_active calls is taken when
+the call is originated and given back when it failed or hung up.  As a
+missed Hangup would keep its place taken, calls fail with the reason
+'Connection lost' when the connection to asterisk is lost, and with
+call_timeout when they are not over within that many seconds.
+"""
+
+import threading
+import time
+from concurrent.futures import Future
+
+from asterisk.manager import CONNECTION_LOST, ManagerException
+
+
+class TokenBucket(object):
+    """
+    Allows rate operations per second on average, up to burst at once
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self):
+        """Take a token, waiting until one is available"""
+
+        with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                time.sleep((1 - self._tokens) / self.rate)
+
+
+class Call(object):
+    """
+    One call of a campaign
+
+    state is queued, originating, up, done or failed.  reason is the
+    Reason of the OriginateResponse or the error message of the
+    Originate, cause the Cause of the Hangup.  future is resolved with
+    the call when it is done or failed.
+    """
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.state = "queued"
+        self.action_id = None
+        self.channel = None
+        self.uniqueid = None
+        self.reason = None
+        self.cause = None
+        self.originated = None
+        self.answered = None
+        self.ended = None
+        self.future = Future()
+
+    def __repr__(self):
+        return "<Call %s %s>" % (self.spec.get("Channel"), self.state)
+
+
+class Campaign(object):
+    """
+    Originates calls from an iterable of call specs, see the module
+
+    rate is the number of originates per second, burst how many may be
+    sent at once after a pause.  max_active bounds the calls being
+    originated or up.  call_timeout is the number of seconds after which
+    a call still being originated or up is given up, None to wait for
+    its Hangup.
+    """
+
+    def __init__(self, manager, calls, rate=1.0, burst=1, max_active=10, call_timeout=None):
+        self.manager = manager
+        self.call_timeout = call_timeout
+        self.calls = []
+        self._specs = iter(calls)
+        self._bucket = TokenBucket(rate, burst)
+        self._slots = threading.BoundedSemaphore(max_active)
+        self.max_active = max_active
+
+        self._lock = threading.Lock()
+        # the calls being originated or up
+        self._by_action_id = {}
+        self._by_uniqueid = {}
+        self._thread = None
+        self._stopped = threading.Event()
+        self._finished = threading.Event()
+        self._exhausted = False
+
+        self.started = None
+        self.active = 0
+        self.high_water = 0
+        self.answered = 0
+        self.failed = 0
+        self.completed = 0
+
+    def start(self):
+        """Start originating on a thread of the campaign"""
+
+        self.manager.register_event("OriginateResponse", self._handle_originate_response)
+        self.manager.register_event("Hangup", self._handle_hangup)
+        self.manager.register_event(CONNECTION_LOST, self._handle_connection_lost)
+        self.started = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name="campaign", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Originate no more calls, calls already up go on"""
+        self._stopped.set()
+
+    def wait(self, timeout=None):
+        """Wait until all calls are over, returns the statistics"""
+
+        self._finished.wait(timeout)
+        return self.stats()
+
+    def stats(self):
+        """Return a dictionary of the campaign statistics"""
+
+        elapsed = time.monotonic() - self.started if self.started is not None else 0.0
+        with self._lock:
+            return {
+                "originated": len(self.calls),
+                "active": self.active,
+                "high_water": self.high_water,
+                "answered": self.answered,
+                "failed": self.failed,
+                "completed": self.completed,
+                "elapsed": elapsed,
+                "originates_per_sec": len(self.calls) / elapsed if elapsed > 0 else 0.0,
+            }
+
+    def _run(self):
+        for spec in self._specs:
+            if not self._acquire():
+                break
+            self._bucket.take()
+            self._originate(Call(spec))
+        with self._lock:
+            self._exhausted = True
+        self._check_finished()
+        while not self._finished.wait(0.1):
+            self._watch()
+
+    def _acquire(self):
+        """Wait for a free place, False when stopped"""
+
+        while not self._slots.acquire(timeout=0.1):
+            self._watch()
+            if self._stopped.is_set():
+                return False
+        if self._stopped.is_set():
+            self._slots.release()
+            return False
+        return True
+
+    def _originate(self, call):
+        cdict = {"Action": "Originate"}
+        cdict.update(call.spec)
+        cdict["Async"] = "true"
+        call.action_id = cdict["ActionID"] = self.manager.new_action_id()
+
+        call.state = "originating"
+        call.originated = time.monotonic()
+        with self._lock:
+            self.calls.append(call)
+            self._by_action_id[call.action_id] = call
+            self.active += 1
+            self.high_water = max(self.high_water, self.active)
+        try:
+            future = self.manager.submit_action(cdict)
+        except ManagerException as e:
+            self._end(call, "failed", error=e)
+            return
+
+        def response(future):
+            try:
+                message = future.result()
+            except ManagerException as e:
+                self._end(call, "failed", error=e)
+                return
+            if message.get_header("Response") != "Success":
+                call.reason = message.get_header("Message")
+                self._end(call, "failed")
+
+        future.add_done_callback(response)
+
+    def _watch(self):
+        """Give up the calls over their timeout or lost with the connection"""
+
+        if not self.manager.connected():
+            self._fail_active("Connection lost")
+            return
+        if self.call_timeout is None:
+            return
+        deadline = time.monotonic() - self.call_timeout
+        with self._lock:
+            expired = [call for call in self._by_action_id.values() if call.originated < deadline]
+        for call in expired:
+            call.reason = "Timeout"
+            self._end(call, "failed")
+
+    def _fail_active(self, reason):
+        with self._lock:
+            active = list(self._by_action_id.values())
+        for call in active:
+            call.reason = reason
+            self._end(call, "failed")
+
+    def _end(self, call, state, error=None):
+        """End a call and give back its place"""
+
+        with self._lock:
+            if call.state in ("done", "failed"):
+                return
+            call.state = state
+            call.ended = time.monotonic()
+            self._by_action_id.pop(call.action_id, None)
+            self._by_uniqueid.pop(call.uniqueid, None)
+            self.active -= 1
+            if state == "failed":
+                self.failed += 1
+            else:
+                self.completed += 1
+        self._slots.release()
+        if call.future.set_running_or_notify_cancel():
+            if error is not None:
+                call.future.set_exception(error)
+            else:
+                call.future.set_result(call)
+        self._check_finished()
+
+    def _check_finished(self):
+        with self._lock:
+            finished = self._exhausted and self.active == 0 and not self._finished.is_set()
+            if finished:
+                self._finished.set()
+        if finished:
+            self.manager.unregister_event("OriginateResponse", self._handle_originate_response)
+            self.manager.unregister_event("Hangup", self._handle_hangup)
+            self.manager.unregister_event(CONNECTION_LOST, self._handle_connection_lost)
+
+    # event handlers
+
+    def _handle_originate_response(self, event, manager):
+        with self._lock:
+            call = self._by_action_id.get(event.get_header("ActionID"))
+            if call is None:
+                return
+            call.channel = event.get_header("Channel")
+            call.reason = event.get_header("Reason")
+            if event.get_header("Response") == "Success":
+                call.uniqueid = event.get_header("Uniqueid")
+                call.state = "up"
+                call.answered = time.monotonic()
+                self._by_uniqueid[call.uniqueid] = call
+                self.answered += 1
+                return
+        self._end(call, "failed")
+
+    def _handle_hangup(self, event, manager):
+        with self._lock:
+            call = self._by_uniqueid.get(event.get_header("Uniqueid"))
+        if call is not None:
+            call.cause = event.get_header("Cause")
+            self._end(call, "done")
+
+    def _handle_connection_lost(self, event, manager):
+        # the Hangups of the calls may be missed while reconnecting
+        self._fail_active("Connection lost")
@@ -0,0 +1,343 @@
+#!/usr/bin/env python
+# vim: set expandtab shiftwidth=4:
+
+"""
+Live table of the channels of an asterisk
+
+A ChannelRegistry loads the channels once with CoreShowChannels (Status
+on asterisk versions without it) and keeps them current from the channel
+events, so looking up a channel needs no round trip to asterisk:
+
+   import asterisk.manager
+   import asterisk.channels
+
+   manager = asterisk.manager.Manager()
+   manager.connect('host')
+   manager.login('user', 'secret')
+
+   channels = asterisk.channels.ChannelRegistry(manager)
+   channels.start()
+
+   channel = channels.by_name('SIP/100-00000001')
+   print(channel.state, channel.linkedid)
+   for channel in channels.by_state('Ringing'):
+      print(channel.name)
+
+Lookups by name, uniqueid, linkedid and state use indexes.  The table is
+reloaded when asterisk sends FullyBooted, which it does after every
+login.  Channel events handled while the channels are loaded are applied
+again on top of the loaded table, they may be newer than it.
+"""
+
+import threading
+from concurrent.futures import Future
+
+from asterisk.manager import ManagerException
+
+# channel snapshot headers of the channel events and their attributes
+_SNAPSHOT = (
+    ("Channel", "name"),
+    ("Uniqueid", "uniqueid"),
+    ("Linkedid", "linkedid"),
+    ("ChannelState", "state_code"),
+    ("ChannelStateDesc", "state"),
+    ("CallerIDNum", "caller_id_num"),
+    ("CallerIDName", "caller_id_name"),
+    ("ConnectedLineNum", "connected_line_num"),
+    ("ConnectedLineName", "connected_line_name"),
+    ("AccountCode", "account_code"),
+    ("Context", "context"),
+    ("Exten", "exten"),
+    ("Priority", "priority"),
+    ("Application", "application"),
+    ("ApplicationData", "application_data"),
+    ("BridgeId", "bridge_id"),
+)
+
+
+class Channel(object):
+    """
+    One channel of the registry
+
+    The attributes are updated in place by the registry.  dialed is the
+    uniqueid of the channel dialed by this one, dial_status the status of
+    the last DialEnd.
+    """
+
+    __slots__ = tuple(attr for header, attr in _SNAPSHOT) + ("dialed", "dial_status")
+
+    def __init__(self, uniqueid):
+        for header, attr in _SNAPSHOT:
+            setattr(self, attr, None)
+        self.uniqueid = uniqueid
+        self.dialed = None
+        self.dial_status = None
+
+    def update(self, headers, prefix=""):
+        """Take the values of the channel snapshot headers"""
+        for header, attr in _SNAPSHOT:
+            value = headers.get(prefix + header)
+            if value is not None:
+                setattr(self, attr, value)
+
+    def __repr__(self):
+        return "<Channel %s %s %s>" % (self.name, self.uniqueid, self.state)
+
+
+class ChannelRegistry(object):
+    """
+    Channels of an asterisk, kept current from manager events
+
+    The lookups return the live Channel objects, their attributes change
+    as events arrive.  Lists of channels are new lists and may be kept.
+    """
+
+    EVENTS = (
+        "Newchannel",
+        "Newstate",
+        "NewCallerid",
+        "NewConnectedLine",
+        "Rename",
+        "Hangup",
+        "DialBegin",
+        "DialEnd",
+        "BridgeEnter",
+        "BridgeLeave",
+    )
+
+    def __init__(self, manager):
+        self.manager = manager
+        self._lock = threading.Lock()
+        self._by_uniqueid = {}
+        self._by_name = {}
+        # dictionaries of channels by uniqueid
+        self._by_linkedid = {}
+        self._by_state = {}
+        # channel events handled while a resync is in flight, with the
+        # number of resyncs
+        self._replay = []
+        self._resyncs = 0
+
+        self._handlers = {
+            "Newchannel": self._update_event,
+            "Newstate": self._update_event,
+            "NewCallerid": self._update_event,
+            "NewConnectedLine": self._update_event,
+            "Rename": self._rename,
+            "Hangup": self._hangup,
+            "DialBegin": self._dial_begin,
+            "DialEnd": self._dial_end,
+            "BridgeEnter": self._bridge_enter,
+            "BridgeLeave": self._bridge_leave,
+        }
+
+    def start(self):
+        """Register for the channel events and load the channels"""
+
+        for name in self.EVENTS:
+            self.manager.register_event(name, self._handle_event)
+        self.manager.register_event("FullyBooted", self._handle_booted)
+        return self.resync().result()
+
+    def stop(self):
+        """Unregister from the manager, the table is no longer updated"""
+
+        for name in self.EVENTS:
+            self.manager.unregister_event(name, self._handle_event)
+        self.manager.unregister_event("FullyBooted", self._handle_booted)
+
+    def resync(self):
+        """
+        Reload the channels from asterisk
+
+        Returns a concurrent.futures.Future that receives the number of
+        channels once the table is replaced.
+        """
+
+        # record the events from before the list is sent
+        with self._lock:
+            self._resyncs += 1
+        result = Future()
+        result.set_running_or_notify_cancel()
+
+        def failed(error):
+            self._load(None)
+            result.set_exception(error)
+
+        def loaded(future, fallback=True):
+            try:
+                channels = future.result()
+            except ManagerException as e:
+                failed(e)
+                return
+            if channels.get_header("Response") == "Error":
+                if fallback:
+                    # asterisk without CoreShowChannels
+                    try:
+                        status = self.manager.submit_list_action({"Action": "Status"})
+                    except ManagerException as e:
+                        failed(e)
+                        return
+                    status.add_done_callback(lambda future: loaded(future, False))
+                else:
+                    failed(ManagerException(channels.get_header("Message")))
+                return
+            result.set_result(self._load(channels))
+
+        try:
+            future = self.manager.submit_list_action({"Action": "CoreShowChannels"})
+        except ManagerException as e:
+            failed(e)
+            return result
+        future.add_done_callback(loaded)
+        return result
+
+    def _load(self, events):
+        """
+        Replace the table by the channels of a list action, None when the
+        resync failed, and apply the recorded events again
+        """
+
+        with self._lock:
+            replay = self._replay
+            self._resyncs -= 1
+            if not self._resyncs:
+                self._replay = []
+            if events is None:
+                return None
+            self._by_uniqueid.clear()
+            self._by_name.clear()
+            self._by_linkedid.clear()
+            self._by_state.clear()
+            for event in events:
+                headers = event.headers
+                uniqueid = headers.get("Uniqueid")
+                if uniqueid is None:
+                    continue
+                channel = Channel(uniqueid)
+                channel.update(headers)
+                self._index(channel)
+            # the events were handled by the dispatch thread before the
+            # list was complete, the table may be older than them
+            for name, headers in replay:
+                self._handlers[name](headers)
+            return len(self._by_uniqueid)
+
+    # indexes, called with the lock held
+
+    def _index(self, channel):
+        self._by_uniqueid[channel.uniqueid] = channel
+        if channel.name is not None:
+            self._by_name[channel.name] = channel
+        if channel.linkedid is not None:
+            self._by_linkedid.setdefault(channel.linkedid, {})[channel.uniqueid] = channel
+        if channel.state is not None:
+            self._by_state.setdefault(channel.state, {})[channel.uniqueid] = channel
+
+    def _unindex(self, channel):
+        del self._by_uniqueid[channel.uniqueid]
+        if self._by_name.get(channel.name) is channel:
+            del self._by_name[channel.name]
+        for index, key in ((self._by_linkedid, channel.linkedid), (self._by_state, channel.state)):
+            channels = index.get(key)
+            if channels is not None:
+                channels.pop(channel.uniqueid, None)
+                if not channels:
+                    del index[key]
+
+    def _update(self, headers, prefix=""):
+        """Create or update the channel of the snapshot headers"""
+
+        uniqueid = headers.get(prefix + "Uniqueid")
+        if uniqueid is None:
+            return None
+        channel = self._by_uniqueid.get(uniqueid)
+        if channel is None:
+            channel = Channel(uniqueid)
+        else:
+            self._unindex(channel)
+        channel.update(headers, prefix)
+        self._index(channel)
+        return channel
+
+    # event handlers
+
+    def _handle_event(self, event, manager):
+        headers = event.headers
+        with self._lock:
+            self._handlers[event.name](headers)
+            if self._resyncs:
+                self._replay.append((event.name, headers))
+
+    def _handle_booted(self, event, manager):
+        # a new session, we may have missed events
+        self.resync()
+
+    def _update_event(self, headers):
+        self._update(headers)
+
+    def _rename(self, headers):
+        channel = self._update(headers)
+        newname = headers.get("Newname")
+        if channel is not None and newname is not None:
+            self._unindex(channel)
+            channel.name = newname
+            self._index(channel)
+
+    def _hangup(self, headers):
+        channel = self._by_uniqueid.get(headers.get("Uniqueid"))
+        if channel is not None:
+            self._unindex(channel)
+
+    def _dial_begin(self, headers):
+        channel = self._update(headers)
+        dest = self._update(headers, "Dest")
+        if channel is not None and dest is not None:
+            channel.dialed = dest.uniqueid
+
+    def _dial_end(self, headers):
+        channel = self._update(headers)
+        self._update(headers, "Dest")
+        if channel is not None:
+            channel.dial_status = headers.get("DialStatus")
+
+    def _bridge_enter(self, headers):
+        channel = self._update(headers)
+        if channel is not None:
+            channel.bridge_id = headers.get("BridgeUniqueid")
+
+    def _bridge_leave(self, headers):
+        channel = self._update(headers)
+        if channel is not None:
+            channel.bridge_id = None
+
+    # lookups
+
+    def by_name(self, name):
+        """Return the channel with this name, None if there is none"""
+        return self._by_name.get(name)
+
+    def by_uniqueid(self, uniqueid):
+        """Return the channel with this uniqueid, None if there is none"""
+        return self._by_uniqueid.get(uniqueid)
+
+    def by_linkedid(self, linkedid):
+        """Return the list of channels of a call"""
+        with self._lock:
+            return list(self._by_linkedid.get(linkedid, {}).values())
+
+    def by_state(self, state):
+        """Return the list of channels in a state, like Up or Ringing"""
+        with self._lock:
+            return list(self._by_state.get(state, {}).values())
+
+    def channels(self):
+        """Return the list of all channels"""
+        with self._lock:
+            return list(self._by_uniqueid.values())
+
+    def __len__(self):
+        return len(self._by_uniqueid)
+
+    def __contains__(self, name):
+        return name in self._by_name
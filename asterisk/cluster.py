@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+# vim: set expandtab shiftwidth=4:
+
+"""
+Many asterisk nodes behind one facade
+
+A ManagerCluster owns a Manager per node.  Actions go to one node,
+chosen explicitly, by the prefix of the channel name or by a consistent
+hash of a key.  Queries for the whole cluster are sent to all nodes at
+once and the answers merged, so they take one round trip instead of one
+per node:
+
+   import asterisk.cluster
+
+   cluster = asterisk.cluster.ManagerCluster(
+      {'pbx1': {'host': '10.0.0.1', 'username': 'user', 'secret': 'secret'},
+       'pbx2': {'host': '10.0.0.2', 'username': 'user', 'secret': 'secret'}},
+      prefixes={'SIP/pbx1-': 'pbx1', 'SIP/pbx2-': 'pbx2'})
+   cluster.connect()
+
+   for node, event in cluster.status():
+      print(node, event['Channel'])
+
+   # routed by the Channel header
+   cluster.send_action({'Action': 'Hangup', 'Channel': 'SIP/pbx2-00000001'})
+   # routed by consistent hash, a key keeps going to the same node
+   cluster.send_action({'Action': 'DBGet', 'Family': 'cf', 'Key': '100'}, key='100')
+
+   for node, event in cluster.events('Hangup'):
+      print(node, event['Channel'])
+
+An action without node, channel or key is routed by its Channel header,
+a channel without a matching prefix by its consistent hash.  Callbacks
+registered with the cluster receive the events of all nodes, with the
+Manager of the node.
+"""
+
+import bisect
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from asterisk import actions
+from asterisk.actions import Action
+from asterisk.eventstream import EventStream
+from asterisk.manager import Manager, ManagerException, ManagerTimeoutException, _event_key
+
+# points of each node on the hash ring
+REPLICAS = 100
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+
+class HashRing(object):
+    """Consistent hashing of keys onto nodes"""
+
+    def __init__(self, nodes=(), replicas=REPLICAS):
+        self.replicas = replicas
+        self._ring = []
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node):
+        for i in range(self.replicas):
+            bisect.insort(self._ring, (_hash("%s-%d" % (node, i)), node))
+
+    def remove(self, node):
+        self._ring = [point for point in self._ring if point[1] != node]
+
+    def node(self, key):
+        """Return the node of key"""
+
+        if not self._ring:
+            raise ManagerException("No nodes")
+        i = bisect.bisect(self._ring, (_hash(str(key)),))
+        return self._ring[i % len(self._ring)][1]
+
+
+class ClusterEventStream(EventStream):
+    """An EventStream over all nodes of a cluster, yields (node, event)"""
+
+    @staticmethod
+    def _key(item):
+        key = _event_key(item[1])
+        return (item[0], key) if key is not None else None
+
+    def _put(self, event, manager):
+        self._queue.put((self.manager.names[manager], event), event.name)
+        self._wake()
+
+
+class ManagerCluster(object):
+    """
+    Managers of many asterisk nodes, see the module
+
+    nodes maps node names to the options of their connection: host, port,
+    username and secret.  prefixes maps channel name prefixes to nodes,
+    the longest matching prefix wins.  manager_options are passed to each
+    Manager.
+    """
+
+    def __init__(self, nodes, prefixes=None, timeout=None, **manager_options):
+        self.nodes = dict(nodes)
+        self.prefixes = sorted((prefixes or {}).items(), key=lambda item: -len(item[0]))
+        self.timeout = timeout
+        self.managers = {}
+        # node names by Manager
+        self.names = {}
+        for name in self.nodes:
+            manager = Manager(timeout=timeout, **manager_options)
+            self.managers[name] = manager
+            self.names[manager] = name
+        self.ring = HashRing(self.nodes)
+        self._event_streams = set()
+
+    def _each(self, function, nodes=None):
+        """Run function(name, manager) for the nodes on parallel threads"""
+
+        nodes = list(self.managers if nodes is None else nodes)
+        with ThreadPoolExecutor(max_workers=max(1, len(nodes))) as executor:
+            futures = dict(
+                (name, executor.submit(function, name, self.managers[name])) for name in nodes
+            )
+        return dict((name, future.result()) for name, future in futures.items())
+
+    def connect(self):
+        """Connect and login to all nodes in parallel"""
+
+        def connect(name, manager):
+            node = self.nodes[name]
+            manager.connect(node["host"], node.get("port", 5038), self.timeout)
+            manager.login(node["username"], node["secret"])
+
+        self._each(connect)
+        return self
+
+    def close(self):
+        """Close the connections to all nodes"""
+
+        for stream in list(self._event_streams):
+            stream.close()
+        self._each(lambda name, manager: manager.close())
+
+    def manager(self, node):
+        """Return the Manager of node"""
+
+        try:
+            return self.managers[node]
+        except KeyError:
+            raise ManagerException("Unknown node %s" % node)
+
+    # routing
+
+    def route(self, node=None, channel=None, key=None):
+        """Return the node for an explicit node, a channel or a key"""
+
+        if node is not None:
+            self.manager(node)
+            return node
+        if channel is not None:
+            for prefix, node in self.prefixes:
+                if channel.startswith(prefix):
+                    return node
+            return self.ring.node(channel)
+        if key is not None:
+            return self.ring.node(key)
+        raise ManagerException("No node, channel or key to route by")
+
+    def _route(self, action, node, channel, key):
+        if node is None and channel is None and key is None:
+            if isinstance(action, Action):
+                channel = getattr(action, "channel", None)
+            else:
+                channel = action.get("Channel")
+        return self.manager(self.route(node, channel, key))
+
+    def submit_action(self, action, node=None, channel=None, key=None):
+        """Send an action to its node, returns the Future of the response"""
+        return self._route(action, node, channel, key).submit_action(action)
+
+    def send_action(self, action, node=None, channel=None, key=None, timeout=None):
+        """Send an action to its node and wait for the response"""
+        return self._route(action, node, channel, key).send_action(action, timeout)
+
+    def send(self, action, node=None, channel=None, key=None, timeout=None):
+        """Send an asterisk.actions.Action to its node, see Manager.send"""
+        return self._route(action, node, channel, key).send(action, timeout)
+
+    # fan out
+
+    def _submit(self, name, action, list_action):
+        manager = self.manager(name)
+        if list_action is None:
+            list_action = isinstance(action, Action) and action.list_action
+        if list_action:
+            return manager.submit_list_action(action)
+        return manager.submit_action(action)
+
+    def submit_all(self, action, list_action=None, nodes=None):
+        """
+        Send an action to all nodes without waiting, returns the Futures
+        of the responses by node
+
+        With list_action the Futures receive EventLists, by default for
+        list Action objects.
+        """
+
+        futures = {}
+        for name in self.managers if nodes is None else nodes:
+            try:
+                futures[name] = self._submit(name, action, list_action)
+            except ManagerException:
+                for future in futures.values():
+                    future.cancel()
+                raise
+        return futures
+
+    def send_all(self, action, list_action=None, nodes=None, timeout=None):
+        """
+        Send an action to all nodes at once and wait for the answers
+
+        Returns a dictionary of the responses (or EventLists) by node.  A
+        node failing to answer has its ManagerException in place of the
+        response, nodes not answering within timeout seconds a
+        ManagerTimeoutException.
+        """
+
+        if timeout is None:
+            timeout = self.timeout
+        futures = {}
+        results = {}
+        for name in self.managers if nodes is None else nodes:
+            try:
+                futures[name] = self._submit(name, action, list_action)
+            except ManagerException as e:
+                results[name] = e
+        wait(futures.values(), timeout)
+        for name, future in futures.items():
+            if not future.done():
+                future.cancel()
+                results[name] = ManagerTimeoutException(
+                    "No answer from %s within %s seconds" % (name, timeout)
+                )
+            elif future.exception() is not None:
+                results[name] = future.exception()
+            else:
+                results[name] = future.result()
+        return results
+
+    def _merge(self, action):
+        """Send a list action to all nodes, returns the (node, event) pairs"""
+
+        results = self.send_all(action)
+        failed = sorted(name for name, result in results.items() if isinstance(result, Exception))
+        if failed:
+            raise ManagerException("%s failed: %s" % (", ".join(failed), results[failed[0]]))
+        return [(name, event) for name, result in sorted(results.items()) for event in result]
+
+    def status(self, channel=""):
+        """Return the Status events of all nodes as (node, event) pairs"""
+
+        return self._merge(actions.Status(channel=channel))
+
+    def core_show_channels(self):
+        """Return the CoreShowChannel events of all nodes as (node, event) pairs"""
+
+        return self._merge(actions.CoreShowChannels())
+
+    def sippeers(self):
+        """Return the PeerEntry events of all nodes as (node, event) pairs"""
+
+        return self._merge(actions.Sippeers())
+
+    def command(self, command):
+        """Execute a command on all nodes, returns the responses by node"""
+
+        return self.send_all(actions.Command(command=command))
+
+    # events
+
+    def register_event(self, event, function, headers=None):
+        """Register a callback for the event on all nodes"""
+
+        for manager in self.managers.values():
+            manager.register_event(event, function, headers)
+
+    def unregister_event(self, event, function, headers=None):
+        """Unregister a callback from all nodes"""
+
+        for manager in self.managers.values():
+            manager.unregister_event(event, function, headers)
+
+    def events(self, filter="*", maxsize=1000, overflow="block", headers=None):
+        """
+        Return an iterator over the events of all nodes as (node, event)
+        pairs, see Manager.events
+        """
+        return ClusterEventStream(self, filter, maxsize, overflow, headers)
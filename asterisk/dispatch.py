@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# vim: set expandtab shiftwidth=4:
+
+"""
+Parallel dispatching of manager events
+
+The Manager runs all event callbacks one after the other on its event
+dispatch thread, one slow callback delays the events of all calls.  With
+a ShardedDispatcher the callbacks run on a pool of worker threads
+instead.  Events are sharded by call: all events with the same Linkedid
+(or Uniqueid when there is no Linkedid) go to the same worker, so the
+events of one call are still handled in order while different calls are
+handled in parallel.  Events without a channel are dispatched on the
+calling thread.
+
+   import asterisk.manager
+
+   manager = asterisk.manager.Manager(dispatch_workers=8)
+
+The callbacks of an event are looked up in a DispatchTable.  The table is
+never changed, registering a callback replaces it by a new table, so the
+dispatching threads need no lock.
+"""
+
+import queue
+import threading
+import traceback
+from fnmatch import fnmatchcase
+
+
+def is_pattern(event):
+    """Check if an event name given to register_event is a glob pattern"""
+    return "*" in event or "?" in event or "[" in event
+
+
+class DispatchTable(object):
+    """
+    Immutable table of the event callbacks
+
+    The table is built from (event, callback) registrations, event is an
+    event name, a glob pattern like 'Queue*' or '*' for all events.  The
+    callbacks of an event are the ones registered for its name, then the
+    ones of matching patterns, then the ones for '*', each in the order
+    they were registered.  They are resolved once per event name and
+    kept in a tuple.
+    """
+
+    def __init__(self, registrations=()):
+        self.registrations = tuple(registrations)
+        names = {}
+        patterns = []
+        everything = []
+        for event, callback in self.registrations:
+            if event == "*":
+                everything.append(callback)
+            elif is_pattern(event):
+                patterns.append((event, callback))
+            else:
+                names.setdefault(event, []).append(callback)
+        self._names = names
+        self._patterns = tuple(patterns)
+        self._all = tuple(everything)
+        # resolved callbacks by event name
+        self._cache = {}
+        for name in names:
+            self._cache[name] = self._resolve(name)
+
+    def _resolve(self, name):
+        callbacks = list(self._names.get(name, ()))
+        for pattern, callback in self._patterns:
+            if fnmatchcase(name, pattern):
+                callbacks.append(callback)
+        callbacks.extend(self._all)
+        return tuple(callbacks)
+
+    def callbacks(self, name):
+        """Return the tuple of callbacks of an event"""
+
+        callbacks = self._cache.get(name)
+        if callbacks is None:
+            # a dictionary assignment is atomic, threads may race here
+            callbacks = self._cache[name] = self._resolve(name)
+        return callbacks
+
+    def register(self, event, callback):
+        """Return a new table with the callback added"""
+        return DispatchTable(self.registrations + ((event, callback),))
+
+    def unregister(self, event, callback):
+        """
+        Return a new table without the first registration of callback
+        for event, raises ValueError if there is none
+        """
+
+        registrations = list(self.registrations)
+        registrations.remove((event, callback))
+        return DispatchTable(registrations)
+
+    def __len__(self):
+        return len(self.registrations)
+
+
+def shard_key(event):
+    """
+    Return the key keeping the events of one call together, None for
+    events not belonging to a channel.
+    """
+
+    return event.peek_header("Linkedid") or event.peek_header("Uniqueid")
+
+
+class ShardedDispatcher(object):
+    """
+    Runs dispatch(event) on a pool of worker threads, sharded by call
+
+    Exceptions of dispatch are printed, they do not end the worker.  With
+    maxsize the queue of each worker is bounded and put blocks while the
+    worker of a call is busy.
+    """
+
+    def __init__(self, dispatch, workers=4, maxsize=0, name="dispatch"):
+        if workers < 1:
+            raise ValueError("need at least one worker")
+        self._dispatch = dispatch
+        self._queues = [queue.Queue(maxsize) for i in range(workers)]
+        self._threads = [
+            threading.Thread(target=self._work, args=(q,), name="%s-%d" % (name, i), daemon=True)
+            for i, q in enumerate(self._queues)
+        ]
+
+    def start(self):
+        """Start the worker threads"""
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        """Stop the workers after their queued events are dispatched"""
+        for q in self._queues:
+            q.put(None)
+        current = threading.current_thread()
+        for thread in self._threads:
+            if thread is not current and thread.ident is not None:
+                thread.join()
+
+    def is_worker(self, thread):
+        """Check if thread is one of our workers"""
+        return thread in self._threads
+
+    def put(self, event):
+        """Dispatch an event on the worker of its call"""
+
+        key = shard_key(event)
+        if key is None:
+            self._run(event)
+        else:
+            self._queues[hash(key) % len(self._queues)].put(event)
+
+    def qsizes(self):
+        """Return the number of events waiting for each worker"""
+        return [q.qsize() for q in self._queues]
+
+    def _run(self, event):
+        try:
+            self._dispatch(event)
+        except Exception:
+            traceback.print_exc()
+
+    def _work(self, q):
+        while True:
+            event = q.get()
+            if event is None:
+                break
+            self._run(event)
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# vim: set expandtab shiftwidth=4:
+
+"""
+Bounded queues for the manager threads
+
+The Manager passes received messages and events between its threads in
+queues.  By default these are unbounded, when the event callbacks fall
+behind the queues grow without limit.  An EventQueue may be bounded with
+one of these policies for a full queue:
+
+ block        the producer waits, in the end asterisk waits for us
+ drop_oldest  the oldest droppable event is discarded
+ drop_newest  the new event is discarded
+ coalesce     the new event replaces a queued event with the same key,
+              by default the same event name and channel; without such
+              an event the producer waits
+
+With drop_events only the events with these names may be dropped or
+coalesced, for other events the producer waits.  Items put without an
+event name (responses, events answering our own actions) are never
+dropped: unless the policy is block they are queued beyond the bound.
+
+   import asterisk.manager
+
+   manager = asterisk.manager.Manager(
+      queue_size=10000, overflow="drop_oldest",
+      drop_events=("VarSet", "Newexten", "RTCPSent", "RTCPReceived"))
+
+Note that whenever the producer waits, a callback waiting for the
+response of an action may wait forever: the response is stuck behind the
+full event queue the callback should drain.
+"""
+
+import queue
+import threading
+import time
+from collections import Counter, deque
+
+BLOCK = "block"
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+COALESCE = "coalesce"
+POLICIES = (BLOCK, DROP_OLDEST, DROP_NEWEST, COALESCE)
+
+
+class EventQueue(object):
+    """
+    A queue with an optional bound and overflow policy
+
+    high_water is the largest size the queue had, dropped and coalesced
+    count discarded events by event name.
+    """
+
+    def __init__(self, maxsize=0, policy=BLOCK, drop_events=None, coalesce_key=None):
+        if policy not in POLICIES:
+            raise ValueError("unknown overflow policy %r" % (policy,))
+        if policy == COALESCE and coalesce_key is None:
+            raise ValueError("coalesce needs a coalesce_key")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.drop_events = frozenset(drop_events) if drop_events else None
+        self._coalesce_key = coalesce_key
+
+        # entries are [item, name, key], key only for coalesce
+        self._entries = deque()
+        self._keys = {}
+        self._mutex = threading.Lock()
+        self._not_empty = threading.Condition(self._mutex)
+        self._not_full = threading.Condition(self._mutex)
+        self._shutdown = False
+
+        self.high_water = 0
+        self.dropped = Counter()
+        self.coalesced = Counter()
+
+    def qsize(self):
+        """Return the number of queued items"""
+        return len(self._entries)
+
+    def _droppable(self, name):
+        return name is not None and (self.drop_events is None or name in self.drop_events)
+
+    def put(self, item, name=None):
+        """
+        Queue an item, name is the event name for events that may be
+        dropped
+        """
+
+        with self._not_full:
+            if self._shutdown:
+                return
+            key = None
+            if self.policy == COALESCE and self._droppable(name):
+                key = self._coalesce_key(item)
+            if self.maxsize > 0 and len(self._entries) >= self.maxsize:
+                if not self._overflow(item, name, key):
+                    return
+            entry = [item, name, key]
+            self._entries.append(entry)
+            if key is not None:
+                self._keys[key] = entry
+            if len(self._entries) > self.high_water:
+                self.high_water = len(self._entries)
+            self._not_empty.notify()
+
+    def _overflow(self, item, name, key):
+        """Make room for an item, returns False if it is discarded"""
+
+        if self.policy == DROP_OLDEST:
+            for i, entry in enumerate(self._entries):
+                if self._droppable(entry[1]):
+                    del self._entries[i]
+                    self.dropped[entry[1]] += 1
+                    return True
+        elif self.policy == DROP_NEWEST:
+            if self._droppable(name):
+                self.dropped[name] += 1
+                return False
+        elif key is not None:
+            entry = self._keys.get(key)
+            if entry is not None:
+                entry[0] = item
+                self.coalesced[name] += 1
+                return False
+
+        if name is None and self.policy != BLOCK:
+            # never drop, exceed the bound
+            return True
+        while len(self._entries) >= self.maxsize:
+            self._not_full.wait()
+            if self._shutdown:
+                return False
+        return True
+
+    def get(self, timeout=None):
+        """
+        Remove and return the next item, waits for one at most timeout
+        seconds and raises queue.Empty then.  Returns None once the queue
+        is shut down.
+        """
+
+        with self._not_empty:
+            if timeout is not None:
+                deadline = time.monotonic() + timeout
+            while not self._entries:
+                if self._shutdown:
+                    return None
+                if timeout is None:
+                    self._not_empty.wait()
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise queue.Empty
+                    self._not_empty.wait(remaining)
+            entry = self._entries.popleft()
+            key = entry[2]
+            if key is not None and self._keys.get(key) is entry:
+                del self._keys[key]
+            self._not_full.notify()
+            return entry[0]
+
+    def shutdown(self):
+        """
+        Discard the queued items and wake all waiting threads, later items
+        are discarded as well
+        """
+
+        with self._mutex:
+            self._shutdown = True
+            self._entries.clear()
+            self._keys.clear()
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+
+    def stats(self):
+        """Return a dictionary of the queue statistics"""
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "high_water": self.high_water,
+            "dropped": dict(self.dropped),
+            "coalesced": dict(self.coalesced),
+        }
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# vim: set expandtab shiftwidth=4:
+
+"""
+Consuming manager events by iteration
+
+Manager.events returns an EventStream, an iterator over the events
+matching a filter.  Each stream has its own bounded EventQueue, filled by
+the event dispatch thread, so the consumer runs on its own thread at its
+own pace:
+
+   import asterisk.manager
+
+   manager = asterisk.manager.Manager()
+   manager.connect('host')
+   manager.login('user', 'secret')
+
+   with manager.events('Hangup') as hangups:
+      for event in hangups:
+         print(event['Channel'])
+
+batch collects events in lists, for handling them in bulk:
+
+   for events in manager.events('CEL', maxsize=10000).batch(500, max_wait=1.0):
+      insert_rows(events)
+
+From asyncio code the stream is iterated with async for, and abatch is
+the asynchronous batch; the event loop is not blocked while waiting.
+
+The filter is an event name or pattern as for Manager.register_event, or
+a list of them, headers restricts the events to the given header values.
+overflow is the policy of the full queue, see asterisk.eventqueue.  With
+block the dispatch thread, and with it all other callbacks, waits for a
+slow consumer.  Iteration ends when the stream or the Manager is closed.
+"""
+
+import asyncio
+import queue
+import threading
+import time
+
+from asterisk.eventqueue import COALESCE, EventQueue
+from asterisk.manager import _event_key
+
+
+class EventStream(object):
+    """
+    An iterator over the events of a Manager, see the module
+    """
+
+    # the coalesce key of a queued item
+    _key = staticmethod(_event_key)
+
+    def __init__(self, manager, filter="*", maxsize=1000, overflow="block", headers=None):
+        self.manager = manager
+        self.filter = (filter,) if isinstance(filter, str) else tuple(filter)
+        self.headers = headers
+        self._queue = EventQueue(
+            maxsize, overflow, coalesce_key=self._key if overflow == COALESCE else None
+        )
+        self._waiter = None
+        self._lock = threading.Lock()
+        self.closed = False
+        manager._event_streams.add(self)
+        for event in self.filter:
+            manager.register_event(event, self._put, headers)
+
+    def _put(self, event, manager):
+        self._queue.put(event, event.name)
+        self._wake()
+
+    def _wake(self):
+        """Wake an async consumer waiting for an event"""
+
+        waiter = self._waiter
+        if waiter is not None:
+            loop, future = waiter
+            loop.call_soon_threadsafe(_set_done, future)
+
+    def close(self):
+        """Stop receiving events, queued events are discarded"""
+
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+        for event in self.filter:
+            self.manager.unregister_event(event, self._put, self.headers)
+        self.manager._event_streams.discard(self)
+        self._queue.shutdown()
+        self._wake()
+
+    def stats(self):
+        """Return the statistics of the queue, see EventQueue.stats"""
+        return self._queue.stats()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # blocking iteration
+
+    def get(self, timeout=None):
+        """
+        Return the next event, None when the stream is closed.  Raises
+        queue.Empty when no event arrives within timeout seconds.
+        """
+        return self._queue.get(timeout)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        event = self._queue.get()
+        if event is None:
+            raise StopIteration
+        return event
+
+    def batch(self, size, max_wait=None):
+        """
+        Iterate over lists of up to size events
+
+        A list is handed out when it is full or max_wait seconds after its
+        first event arrived.  The last list may be short.
+        """
+
+        while True:
+            event = self._queue.get()
+            if event is None:
+                return
+            events = [event]
+            deadline = time.monotonic() + max_wait if max_wait is not None else None
+            while len(events) < size:
+                try:
+                    if deadline is None:
+                        event = self._queue.get()
+                    else:
+                        event = self._queue.get(max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if event is None:
+                    yield events
+                    return
+                events.append(event)
+            yield events
+
+    # asynchronous iteration
+
+    async def aget(self, timeout=None):
+        """Return the next event like get, without blocking the event loop"""
+
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                return self._queue.get(0)
+            except queue.Empty:
+                pass
+            future = loop.create_future()
+            self._waiter = (loop, future)
+            try:
+                # an event may have come before the waiter was set
+                try:
+                    return self._queue.get(0)
+                except queue.Empty:
+                    pass
+                try:
+                    await asyncio.wait_for(future, timeout)
+                except asyncio.TimeoutError:
+                    raise queue.Empty
+            finally:
+                self._waiter = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        event = await self.aget()
+        if event is None:
+            raise StopAsyncIteration
+        return event
+
+    async def abatch(self, size, max_wait=None):
+        """The asynchronous variant of batch"""
+
+        while True:
+            event = await self.aget()
+            if event is None:
+                return
+            events = [event]
+            deadline = time.monotonic() + max_wait if max_wait is not None else None
+            while len(events) < size:
+                try:
+                    if deadline is None:
+                        event = await self.aget()
+                    else:
+                        event = await self.aget(max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if event is None:
+                    yield events
+                    return
+                events.append(event)
+            yield events
+
+
+def _set_done(future):
+    if not future.done():
+        future.set_result(None)
@@ -0,0 +1,374 @@
+#!/usr/bin/env python
+# vim: set expandtab shiftwidth=4:
+
+"""
+A stand-in for the asterisk manager interface
+
+FakeAMIServer speaks enough of the manager protocol to run a Manager
+without an asterisk: the greeting, Login, Logoff, Ping, Originate,
+Status and CoreShowChannels as EventLists, Command in the old
+--END COMMAND-- and the new Output: format, Events and Filter.  It can
+flood its clients with synthetic events for load tests:
+
+   import asterisk.fakeserver
+   import asterisk.manager
+
+   server = asterisk.fakeserver.FakeAMIServer(channels=100)
+   host, port = server.start()
+
+   manager = asterisk.manager.Manager()
+   manager.connect(host, port)
+   manager.login('user', 'secret')
+
+   server.flood(count=100000, rate=5000)
+
+Run it as a program to serve other processes:
+
+   python -m asterisk.fakeserver --port 5038
+
+More actions may be added with add_action.  A handler is called with the
+session and the dictionary of the action headers and returns the list of
+messages to send, see FakeAMIServer.response.
+"""
+
+import socket
+import socketserver
+import threading
+import time
+
+CRLF = "\r\n"
+
+
+class _Session(socketserver.BaseRequestHandler):
+    """One client connection of the server"""
+
+    def setup(self):
+        self.fake = self.server.fake
+        self.logged_in = False
+        self._sendlock = threading.Lock()
+
+    def send(self, messages):
+        """Send a list of messages at once"""
+        data = "".join(messages).encode()
+        with self._sendlock:
+            self.request.sendall(data)
+
+    def handle(self):
+        fake = self.fake
+        self.send(["%s/%s%s" % (fake.title, fake.version, CRLF)])
+        fake._add_session(self)
+        try:
+            buf = b""
+            while True:
+                data = self.request.recv(65536)
+                if not data:
+                    break
+                # clients may end lines with LF only
+                buf += data.replace(b"\r\n", b"\n")
+                *actions, buf = buf.split(b"\n\n")
+                out = []
+                for action in actions:
+                    headers = {}
+                    for line in action.decode("utf-8", "replace").split("\n"):
+                        key, sep, value = line.partition(":")
+                        if sep:
+                            headers.setdefault(key.strip(), value.strip())
+                    if not headers:
+                        continue
+                    out.extend(fake._handle(self, headers))
+                    if headers.get("Action", "").lower() == "logoff":
+                        self.send(out)
+                        return
+                if out:
+                    if fake.response_delay:
+                        time.sleep(fake.response_delay)
+                    self.send(out)
+        except OSError:
+            pass
+        finally:
+            fake._remove_session(self)
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class FakeAMIServer(object):
+    """
+    A fake asterisk manager, serving on a thread of this process
+
+    With username, only that username and secret may login.  channels is
+    the number of channels listed by Status and CoreShowChannels,
+    command_output the output of every Command, old_command selects the
+    --END COMMAND-- format of older asterisk versions.  response_delay
+    delays every batch of responses by that many seconds.
+    """
+
+    title = "Asterisk Call Manager"
+
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=0,
+        username=None,
+        secret=None,
+        channels=10,
+        command_output="fake command output\n",
+        old_command=False,
+        response_delay=0,
+        version="5.0.1",
+    ):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.secret = secret
+        self.channels = channels
+        self.command_output = command_output
+        self.old_command = old_command
+        self.response_delay = response_delay
+        self.version = version
+
+        self.actions = {
+            "login": self._login,
+            "logoff": self._logoff,
+            "ping": self._ping,
+            "originate": self._originate,
+            "status": self._status,
+            "coreshowchannels": self._core_show_channels,
+            "command": self._command,
+            "events": self._success,
+            "filter": self._success,
+        }
+        # number of received actions by name
+        self.received = {}
+
+        self._server = None
+        self._sessions = set()
+        self._lock = threading.Lock()
+        self._seq = 0
+
+    @property
+    def address(self):
+        """The (host, port) the server listens on"""
+        return self._server.server_address[:2]
+
+    def start(self):
+        """Start serving, returns the address"""
+
+        self._server = _Server((self.host, self.port), _Session)
+        self._server.fake = self
+        thread = threading.Thread(target=self._server.serve_forever, name="fakeserver", daemon=True)
+        thread.start()
+        return self.address
+
+    def serve_forever(self):
+        """Serve on the calling thread"""
+
+        self._server = _Server((self.host, self.port), _Session)
+        self._server.fake = self
+        self._server.serve_forever()
+
+    def stop(self):
+        """Stop serving and close all client connections"""
+
+        self._server.shutdown()
+        self._server.server_close()
+        with self._lock:
+            sessions = list(self._sessions)
+        for session in sessions:
+            try:
+                session.request.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def add_action(self, name, handler):
+        """Handle the action name with handler(session, headers)"""
+        self.actions[name.lower()] = handler
+
+    def _add_session(self, session):
+        with self._lock:
+            self._sessions.add(session)
+
+    def _remove_session(self, session):
+        with self._lock:
+            self._sessions.discard(session)
+
+    def _next_seq(self):
+        with self._lock:
+            self._seq += 1
+            return self._seq
+
+    # messages
+
+    @staticmethod
+    def response(headers):
+        """Format a message of a list of (header, value) pairs"""
+        return "".join("%s: %s\r\n" % item for item in headers) + CRLF
+
+    def _handle(self, session, headers):
+        name = headers.get("Action", "").lower()
+        with self._lock:
+            self.received[name] = self.received.get(name, 0) + 1
+        handler = self.actions.get(name)
+        if handler is None:
+            return [self._reply(headers, "Error", Message="Invalid/unknown command")]
+        if name != "login" and not session.logged_in:
+            return [self._reply(headers, "Error", Message="Permission denied")]
+        return handler(session, headers)
+
+    def _reply(self, headers, response="Success", **values):
+        items = [("Response", response)]
+        if "ActionID" in headers:
+            items.append(("ActionID", headers["ActionID"]))
+        items.extend(values.items())
+        return self.response(items)
+
+    def _event(self, name, headers, action_id=None):
+        items = [("Event", name)]
+        if action_id is not None:
+            items.append(("ActionID", action_id))
+        items.extend(headers)
+        return self.response(items)
+
+    def _channel(self, i):
+        """The snapshot headers of fake channel i"""
+        return [
+            ("Channel", "SIP/fake-%08x" % i),
+            ("ChannelState", "6"),
+            ("ChannelStateDesc", "Up"),
+            ("CallerIDNum", "%d" % (1000 + i)),
+            ("Context", "default"),
+            ("Exten", "100"),
+            ("Priority", "1"),
+            ("Uniqueid", "1000000000.%d" % i),
+            ("Linkedid", "1000000000.%d" % i),
+        ]
+
+    # actions
+
+    def _success(self, session, headers):
+        return [self._reply(headers)]
+
+    def _login(self, session, headers):
+        if self.username is not None and (
+            headers.get("Username") != self.username or headers.get("Secret") != self.secret
+        ):
+            return [self._reply(headers, "Error", Message="Authentication failed")]
+        session.logged_in = True
+        return [
+            self._reply(headers, Message="Authentication accepted"),
+            self._event("FullyBooted", [("Privilege", "system,all"), ("Status", "Fully Booted")]),
+        ]
+
+    def _logoff(self, session, headers):
+        return [self._reply(headers, "Goodbye", Message="Thanks for all the fish.")]
+
+    def _ping(self, session, headers):
+        return [self._reply(headers, Ping="Pong", Timestamp="%.6f" % time.time())]
+
+    def _originate(self, session, headers):
+        seq = self._next_seq()
+        uniqueid = "2000000000.%d" % seq
+        channel = headers.get("Channel", "SIP/fake")
+        call = [("Channel", "%s-%08x" % (channel, seq)), ("Uniqueid", uniqueid)]
+        messages = [self._reply(headers, Message="Originate successfully queued")]
+        if headers.get("Async", "").lower() in ("true", "yes", "1"):
+            messages.append(self._event(
+                "OriginateResponse",
+                [("Response", "Success")] + call + [("Reason", "4")],
+                headers.get("ActionID"),
+            ))
+        messages.append(self._event(
+            "Hangup",
+            call + [("Linkedid", uniqueid), ("Cause", "16"), ("Cause-txt", "Normal Clearing")],
+        ))
+        return messages
+
+    def _list(self, headers, item, complete):
+        action_id = headers.get("ActionID")
+        messages = [self._reply(headers, EventList="start", Message="Channel status will follow")]
+        for i in range(self.channels):
+            messages.append(self._event(item, self._channel(i), action_id))
+        messages.append(self._event(
+            complete, [("EventList", "Complete"), ("ListItems", str(self.channels))], action_id
+        ))
+        return messages
+
+    def _status(self, session, headers):
+        return self._list(headers, "Status", "StatusComplete")
+
+    def _core_show_channels(self, session, headers):
+        return self._list(headers, "CoreShowChannel", "CoreShowChannelsComplete")
+
+    def _command(self, session, headers):
+        output = self.command_output
+        if callable(output):
+            output = output(headers.get("Command", ""))
+        if self.old_command:
+            items = [("Response", "Follows"), ("Privilege", "Command")]
+            if "ActionID" in headers:
+                items.append(("ActionID", headers["ActionID"]))
+            return [self.response(items)[:-2] + output + "--END COMMAND--" + CRLF + CRLF]
+        lines = [("Output", line) for line in output.splitlines()]
+        return [self._reply(headers, Message="Command output follows")[:-2] + self.response(lines)]
+
+    # load
+
+    def flood(self, count=10000, rate=None, name="VarSet", channels=1000, wait=True):
+        """
+        Send count synthetic events to all logged in clients
+
+        rate is the number of events per second, None to send as fast as
+        possible.  The events carry the snapshot headers of one of
+        channels channels.  With wait False the events are sent from a
+        thread, which is returned.
+        """
+
+        if not wait:
+            thread = threading.Thread(
+                target=self.flood, args=(count, rate, name, channels), daemon=True
+            )
+            thread.start()
+            return thread
+
+        batch = 100 if rate is None else max(1, min(100, int(rate // 100)))
+        start = time.perf_counter()
+        sent = 0
+        while sent < count:
+            n = min(batch, count - sent)
+            messages = [
+                self._event(name, self._channel((sent + i) % channels) + [("Seq", str(sent + i))])
+                for i in range(n)
+            ]
+            with self._lock:
+                sessions = [session for session in self._sessions if session.logged_in]
+            for session in sessions:
+                try:
+                    session.send(messages)
+                except OSError:
+                    pass
+            sent += n
+            if rate is not None:
+                delay = sent / rate - (time.perf_counter() - start)
+                if delay > 0:
+                    time.sleep(delay)
+        return sent
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="fake asterisk manager interface")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5038)
+    parser.add_argument("--channels", type=int, default=10)
+    parser.add_argument("--old-command", action="store_true")
+    args = parser.parse_args()
+
+    server = FakeAMIServer(args.host, args.port, channels=args.channels, old_command=args.old_command)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+# vim: set expandtab shiftwidth=4:
+
+"""
+Framing of the Asterisk Manager protocol
+
+This module splits the byte stream received from the asterisk manager
+into messages.  It does no I/O itself and is shared by the threaded and
+the asyncio manager; it may as well be fed from a test harness or a
+recording:
+
+   import asterisk.framing
+
+   parser = asterisk.framing.FrameParser()
+   buf = bytearray(asterisk.framing.RECV_SIZE)
+   while True:
+      n = sock.recv_into(buf)
+      if not n:
+         break
+      for frame in parser.feed(memoryview(buf)[:n]):
+         print(asterisk.manager.ManagerMsg.from_frame(frame))
+
+A frame is the bytes of one message including the line end of its last
+line but without the empty line ending the message.  Besides the empty
+line, two special cases end a message:
+
+ * 'Response: Follows' (Command in older asterisk versions) ends with the
+   marker --END COMMAND--, the output may contain empty lines.
+ * A status response not announcing an EventList (older asterisk
+   versions) is kept together with its status events up to
+   StatusComplete.
+
+A message may be streamed instead of returned as a frame: when the
+ActionID of a message is a key of streams, its complete lines are passed
+to the stream callback as they arrive, the parser does not keep them.
+The callback is called as stream(data, done), done is True for the last
+lines of the message.
+"""
+
+from sys import intern
+
+# size of the receive buffer of the managers
+RECV_SIZE = 65536
+
+CRLF = b"\r\n"
+END_OF_MESSAGE = b"\r\n\r\n"
+FOLLOWS = b"Response: Follows"
+END_COMMAND = b"--END COMMAND--"
+STATUS_FOLLOWS = b"status will follow"
+STATUS_COMPLETE = b"StatusComplete"
+EVENTLIST_START = b"EventList: start"
+GREETING_HEADER = b"Response: Generated Header\r\n"
+EVENT_PREFIX = b"Event: "
+ACTION_ID = b"\nActionID: "
+# how far into a message to look for the ActionID of a stream
+STREAM_PEEK = 512
+
+# decoded event names, by raw name
+_event_names = {}
+
+
+def peek_event(frame):
+    """
+    Return the event name of a frame without parsing it, None if the
+    frame does not start with an Event header.  Event names are interned.
+    """
+
+    if not frame.startswith(EVENT_PREFIX):
+        return None
+    eol = frame.find(CRLF)
+    raw = frame[len(EVENT_PREFIX):eol]
+    name = _event_names.get(raw)
+    if name is None:
+        name = _event_names[raw] = intern(raw.strip().decode("utf-8", "replace"))
+    return name
+
+
+def peek_header(frame, hname, defval=None):
+    """
+    Return the specfied header of a frame without parsing it
+
+    Only the first occurrence of the header is found.
+    """
+
+    key = hname.encode() + b": "
+    if frame.startswith(key):
+        pos = len(key)
+    else:
+        pos = frame.find(b"\n" + key)
+        if pos < 0:
+            return defval
+        pos += len(key) + 1
+    eol = frame.find(b"\n", pos)
+    if eol < 0:
+        eol = len(frame)
+    return frame[pos:eol].strip().decode("utf-8", "replace")
+
+
+def has_action_id(frame):
+    """Check if a frame carries an ActionID header"""
+    return ACTION_ID in frame
+
+
+class FrameParser(object):
+    """
+    Incremental parser splitting manager data into frames
+
+    The data passed to feed is collected in one buffer which is scanned
+    only once: the parser remembers where a search for the end of the
+    current message stopped.
+    """
+
+    def __init__(self, greeting=True, streams=None):
+        self.buffer = bytearray()
+
+        # stream callbacks by ActionID (bytes)
+        self.streams = streams if streams is not None else {}
+
+        # set by the greeting line
+        self.title = None
+        self.version = None
+        self._greeting = greeting
+
+        # state of the message at the start of the buffer
+        self._new = True  # nothing known yet
+        self._first = True  # looking for the end of the first block
+        self._marker = None  # marker to see before the end
+        self._scan = 0  # where to continue searching
+        self._stream = None  # stream callback of the message
+        self._checked = False  # looked for the stream of the message
+
+    def feed(self, data):
+        """Add received data, returns the list of completed frames"""
+
+        self.buffer += data
+        return self.frames()
+
+    def frames(self):
+        """Return the list of complete frames in the buffer"""
+
+        buf = self.buffer
+        frames = []
+        start = 0
+
+        if self._greeting:
+            eol = buf.find(CRLF)
+            if eol < 0:
+                return frames
+            self._greeting = False
+            line = bytes(buf[:eol])
+            if b"/" in line and b":" not in line:
+                title, version = line.split(b"/", 1)
+                self.title = title.strip().decode("utf-8", "replace")
+                self.version = version.strip().decode("utf-8", "replace")
+                # fake message header
+                frames.append(GREETING_HEADER + line + CRLF)
+                start = eol + 2
+
+        while True:
+            if self._new:
+                # ignore empty lines at start
+                while buf.startswith(CRLF, start):
+                    start += 2
+            if not self._checked and self.streams:
+                self._find_stream(buf, start)
+            end = self._find_end(buf, start)
+            if end < 0:
+                break
+            if self._stream is not None:
+                self._stream(bytes(buf[start:end + 2]), True)
+            else:
+                frames.append(bytes(buf[start:end + 2]))
+            start = end + 4
+            self._new = True
+            self._stream = None
+            self._checked = False
+
+        if self._stream is not None and not self._new:
+            # pass on the complete lines, the end of the message is not
+            # before _scan
+            eol = buf.rfind(b"\n", start, self._scan)
+            if eol >= 0:
+                self._stream(bytes(buf[start:eol + 1]), False)
+                start = eol + 1
+
+        if start:
+            del buf[:start]
+            if not self._new:
+                self._scan -= start
+        return frames
+
+    def _find_stream(self, buf, start):
+        """Look up the stream callback of the message at start"""
+
+        # the ActionID is in the first lines, before any empty line
+        limit = buf.find(END_OF_MESSAGE, start, start + STREAM_PEEK)
+        if limit < 0:
+            limit = start + STREAM_PEEK
+        pos = buf.find(ACTION_ID, start, limit)
+        if pos < 0:
+            # give up once the headers are behind us
+            self._checked = len(buf) >= limit
+            return
+        pos += len(ACTION_ID)
+        eol = buf.find(CRLF, pos)
+        if eol < 0:
+            return
+        self._checked = True
+        self._stream = self.streams.get(bytes(buf[pos:eol]).strip())
+
+    def _find_end(self, buf, start):
+        """Return the index of the empty line ending the message at start"""
+
+        if self._new:
+            # we need the first line to know what kind of message it is
+            if len(buf) - start < len(FOLLOWS) and buf.find(CRLF, start) < 0:
+                return -1
+            self._new = False
+            self._scan = start
+            if buf.startswith(FOLLOWS, start):
+                self._first = False
+                self._marker = END_COMMAND
+            else:
+                self._first = True
+                self._marker = None
+
+        while True:
+            if self._marker is not None:
+                pos = buf.find(self._marker, self._scan)
+                if pos < 0:
+                    self._scan = max(self._scan, len(buf) - len(self._marker) + 1)
+                    return -1
+                self._scan = pos + len(self._marker)
+                self._marker = None
+
+            end = buf.find(END_OF_MESSAGE, self._scan)
+            if end < 0:
+                self._scan = max(self._scan, len(buf) - len(END_OF_MESSAGE) + 1)
+                return -1
+
+            if self._first:
+                self._first = False
+                if self._stream is not None:
+                    return end
+                # a status response without EventList is followed by
+                # its events, wait for the StatusComplete event
+                if (
+                    buf.find(STATUS_FOLLOWS, start, end) >= 0
+                    and buf.find(EVENTLIST_START, start, end) < 0
+                ):
+                    self._marker = STATUS_COMPLETE
+                    self._scan = end
+                    continue
+            return end
@@ -52,24 +52,108 @@ Not all manager actions are implmented as of yet, feel free to add them
 and submit patches.
 """
 
+import re
 import socket
 import threading
 import queue
+import time
+from collections import Counter
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from sys import intern
+
+from asterisk import actions
+from asterisk.actions import Action
+from asterisk.dispatch import DispatchTable, ShardedDispatcher, is_pattern
+from asterisk.eventqueue import COALESCE, EventQueue
+from asterisk.framing import (
+    END_COMMAND,
+    GREETING_HEADER,
+    FrameParser,
+    RECV_SIZE,
+    has_action_id,
+    peek_event,
+    peek_header,
+)
 
 EOL = "\n"
+END_COMMAND_TEXT = END_COMMAND.decode()
 
 
 class ManagerMsg(object):
-    """A manager interface message"""
+    """
+    A manager interface message
+
+    The message keeps the raw frame it was received as, the headers and
+    data are parsed on first access.  Header names and event names are
+    interned.
+    """
+
+    __slots__ = ("_frame", "_headers", "_data")
 
     def __init__(self, response):
         # the raw response, straight from the horse's mouth:
-        self.response = response
-        self.data = ""
-        self.headers = {}
-
-        # parse the response
-        self.parse(response)
+        self._frame = "".join(response).encode()
+        self._headers = None
+        self._data = None
+
+    @classmethod
+    def from_frame(cls, frame):
+        """Create a message from a frame of asterisk.framing.FrameParser"""
+
+        message = cls.__new__(cls)
+        message._frame = frame
+        message._headers = None
+        message._data = None
+        return message
+
+    @property
+    def frame(self):
+        """The raw message as received"""
+        return self._frame
+
+    @property
+    def response(self):
+        """The raw message as a list of lines"""
+        lines = self._text().split(EOL)
+        last = lines.pop()
+        lines = [line + EOL for line in lines]
+        if last:
+            lines.append(last)
+        return lines
+
+    @property
+    def headers(self):
+        if self._headers is None:
+            self.parse()
+        return self._headers
+
+    @property
+    def data(self):
+        if self._data is None:
+            self.parse()
+        return self._data
+
+    def _text(self):
+        return self._frame.decode("utf-8", "replace").replace("\r\n", EOL)
+
+    def parse(self, response=None):
+        """Parse a manager message, by default the frame it was created from"""
+
+        text = self._text() if response is None else "".join(response)
+        headers = {}
+        pos = 0
+        while True:
+            # all valid header lines end in \r\n
+            eol = text.find(EOL, pos)
+            if eol < 0:
+                break
+            colon = text.find(":", pos, eol)
+            if colon < 0:
+                # invalid header, start of multi-line data response
+                break
+            headers[intern(text[pos:colon].strip())] = text[colon + 1:eol].strip()
+            pos = eol + 1
+        self._data = text[pos:]
 
         # This is an unknown message, may happen if a command (notably
         # 'dialplan show something') contains a \n\r\n sequence in the
@@ -82,33 +166,29 @@ class ManagerMsg(object):
         # commands sent and their expected return syntax. In that case
         # we could wait for --END COMMAND-- for 'command'.
         # B0rken in asterisk. This should be parseable without context.
-        if "Event" not in self.headers and "Response" not in self.headers:
+        if "Event" in headers:
+            headers["Event"] = intern(headers["Event"])
+        elif "Response" not in headers:
             # there are commands that return the ActionID but not
             # 'Response', e.g., IAXpeers in Asterisk 1.4.X
-            if self.has_header("ActionID"):
-                self.headers["Response"] = "Generated Header"
-            elif "--END COMMAND--" in self.data:
-                self.headers["Event"] = "NoClue"
+            if "ActionID" in headers:
+                headers["Response"] = "Generated Header"
+            elif "--END COMMAND--" in self._data:
+                headers["Event"] = "NoClue"
             else:
-                self.headers["Response"] = "Generated Header"
+                headers["Response"] = "Generated Header"
+        self._headers = headers
 
-    def parse(self, response):
-        """Parse a manager message"""
+    def peek_header(self, hname, defval=None):
+        """
+        Return the specfied header without parsing the message
 
-        data = []
-        for n, line in enumerate(response):
-            # all valid header lines end in \r\n
-            if not line.endswith(EOL):
-                data.extend(response[n:])
-                break
-            try:
-                k, v = (x.strip() for x in line.split(":", 1))
-                self.headers[k] = v
-            except ValueError:
-                # invalid header, start of multi-line data response
-                data.extend(response[n:])
-                break
-        self.data = "".join(data)
+        Only the first occurrence of the header in the frame is found.
+        """
+
+        if self._headers is not None:
+            return self._headers.get(hname, defval)
+        return peek_header(self._frame, hname, defval)
 
     def has_header(self, hname):
         """Check for a header"""
@@ -130,20 +210,36 @@ class ManagerMsg(object):
 
 
 class Event(object):
-    """Manager interface Events, __init__ expects and 'Event' message"""
+    """
+    Manager interface Events, __init__ expects and 'Event' message
 
-    def __init__(self, message):
+    The name may be passed when already known from the frame (see
+    asterisk.framing.peek_event), the message is then parsed only when
+    the headers are accessed.
+    """
+
+    __slots__ = ("message", "name")
+
+    def __init__(self, message, name=None):
         # store all of the event data
         self.message = message
-        self.data = message.data
-        self.headers = message.headers
 
-        # if this is not an event message we have a problem
-        if not message.has_header("Event"):
-            raise ManagerException("Trying to create event from non event message")
+        if name is None:
+            # if this is not an event message we have a problem
+            if not message.has_header("Event"):
+                raise ManagerException("Trying to create event from non event message")
+
+            # get the event name
+            name = message.get_header("Event")
+        self.name = name
 
-        # get the event name
-        self.name = message.get_header("Event")
+    @property
+    def headers(self):
+        return self.message.headers
+
+    @property
+    def data(self):
+        return self.message.data
 
     def has_header(self, hname):
         """Check for a header"""
@@ -153,36 +249,623 @@ class Event(object):
         """Return the specfied header"""
         return self.headers.get(hname, defval)
 
+    def peek_header(self, hname, defval=None):
+        """Return the specfied header without parsing, see ManagerMsg.peek_header"""
+        return self.message.peek_header(hname, defval)
+
     def __getitem__(self, hname):
         """Return the specfied header"""
         return self.headers[hname]
 
     def __repr__(self):
-        return self.headers["Event"]
+        return self.name
 
     def get_action_id(self):
         return self.headers.get("ActionID", 0000)
 
 
-class Manager(object):
+class _HeaderFilter(object):
+    """An event callback only called for events with the given header values"""
+
+    __slots__ = ("function", "headers")
+
+    def __init__(self, function, headers):
+        self.function = function
+        self.headers = tuple(headers.items())
+
+    @property
+    def __wrapped__(self):
+        return self.function
+
+    def __call__(self, event, manager):
+        for hname, value in self.headers:
+            if event.get_header(hname) != value:
+                return None
+        return self.function(event, manager)
+
+
+# characters special in the POSIX regular expressions of asterisk filters
+_filter_special = re.compile(r"([.\[\]()*+?{}|^$\\])")
+
+
+def _filter_escape(string):
+    return _filter_special.sub(r"\\\1", string)
+
+
+def _glob_regex(pattern):
+    """Translate a glob pattern to a POSIX regular expression"""
+
+    regex = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        i += 1
+        if c == "*":
+            regex.append(".*")
+        elif c == "?":
+            regex.append(".")
+        elif c == "[" and "]" in pattern[i + 1:]:
+            end = pattern.index("]", i + 1)
+            chars = pattern[i:end]
+            if chars.startswith("!"):
+                chars = "^" + chars[1:]
+            regex.append("[%s]" % chars)
+            i = end + 1
+        else:
+            regex.append(_filter_escape(c))
+    return "".join(regex)
+
+
+def filter_regex(event, headers=None):
+    """
+    Return the regular expression of an asterisk event Filter passing
+    the specified event, which may be a glob pattern.  Only the first of
+    the headers is used, the order of headers in an event is not known.
+    """
+
+    if is_pattern(event):
+        regex = "Event: " + _glob_regex(event)
+    else:
+        regex = "Event: " + _filter_escape(event)
+    if headers:
+        hname, value = next(iter(headers.items()))
+        regex += ".*%s: %s" % (_filter_escape(hname), _filter_escape(value))
+    return regex
+
+
+class EventList(object):
+    """
+    The result of a list-style action
+
+    Actions like Status, Sippeers or CoreShowChannels answer with a
+    response followed by one event per item and a completion event, all
+    carrying the ActionID of the action.  The item events are collected in
+    events and the completion event is kept in complete.  Headers and data
+    are those of the response.
+    """
+
+    def __init__(self, response, events=None, complete=None):
+        self.response = response
+        self.events = events if events is not None else []
+        self.complete = complete
+
+    @property
+    def headers(self):
+        return self.response.headers
+
+    @property
+    def data(self):
+        return self.response.data
+
+    def has_header(self, hname):
+        """Check for a header of the response"""
+        return self.response.has_header(hname)
+
+    def get_header(self, hname, defval=None):
+        """Return the specfied header of the response"""
+        return self.response.get_header(hname, defval)
+
+    def __getitem__(self, hname):
+        """Return the specfied header of the response"""
+        return self.response[hname]
+
+    def __iter__(self):
+        return iter(self.events)
+
+    def __repr__(self):
+        return repr(self.response)
+
+
+def is_list_response(response):
+    """Check if a response announces an EventList"""
+    return response.get_header("EventList") == "start"
+
+
+def is_list_complete(event):
+    """Check if an event completes an EventList"""
+    return event.get_header("EventList") == "Complete" or event.name.endswith("Complete")
+
+
+class _ListCollector(object):
+    """
+    Collects the response and the events of a list action into an
+    EventList, its future is resolved when the list is complete.
+
+    The response is handed in from a future callback, so it may race with
+    the first events of the list.  Item events only come from the message
+    thread and are added without the lock, a streaming consumer may block
+    the message thread there.
+    """
+
     def __init__(self):
+        self.future = Future()
+        self._lock = threading.Lock()
+        self._response = None
+        self._events = []
+        self._complete = None
+
+    def _add(self, event):
+        self._events.append(event)
+
+    def _finish(self):
+        if self.future.set_running_or_notify_cancel():
+            self.future.set_result(EventList(self._response, self._events, self._complete))
+
+    def response(self, response):
+        """Add the response, returns True when the list is complete"""
+        with self._lock:
+            self._response = response
+            done = self._is_complete()
+        if done:
+            self._finish()
+        return done
+
+    def event(self, event):
+        """Add an event, returns True when the list is complete"""
+        if not is_list_complete(event):
+            self._add(event)
+            return False
+        with self._lock:
+            self._complete = event
+            done = self._is_complete()
+        if done:
+            self._finish()
+        return done
+
+    def _is_complete(self):
+        if self._response is None:
+            return False
+        return self._complete is not None or not is_list_response(self._response)
+
+    def fail(self, error):
+        if self.future.set_running_or_notify_cancel():
+            self.future.set_exception(error)
+
+
+class _ListStream(_ListCollector):
+    """
+    A list collector handing the events to a consumer as they arrive
+    instead of keeping them, see Manager.iter_list_action.
+
+    The bounded queue blocks the message thread when the consumer falls
+    behind.  None in the queue marks the end of the list.
+    """
+
+    def __init__(self, maxsize=0):
+        _ListCollector.__init__(self)
+        self.queue = queue.Queue(maxsize)
+        self.closed = False
+
+    def _add(self, event):
+        if not self.closed:
+            self.queue.put(event)
+
+    def _finish(self):
+        _ListCollector._finish(self)
+        self._add(None)
+
+    def fail(self, error):
+        _ListCollector.fail(self, error)
+        self._add(None)
+
+    def close(self):
+        """Stop consuming, events still arriving are dropped"""
+        self.closed = True
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                break
+
+
+# headers of a streamed Command response
+_COMMAND_HEADERS = frozenset(("Response", "Privilege", "ActionID", "Message"))
+
+
+class _CommandStream(object):
+    """
+    Receives the output of a Command action from the frame parser of the
+    reading thread, see Manager.command_lines.
+
+    The bounded queue blocks the reading thread when the consumer falls
+    behind.  None in the queue marks the end of the output.
+    """
+
+    def __init__(self, maxsize=0):
+        self.queue = queue.Queue(maxsize)
+        self.closed = False
+        self.error = None
+
+    def __call__(self, data, done):
+        self._add(data)
+        if done:
+            self._add(None)
+
+    def _add(self, data):
+        if not self.closed:
+            self.queue.put(data)
+
+    def fail(self, error):
+        self.error = error
+        self._add(None)
+
+    def close(self):
+        """Stop consuming, output still arriving is dropped"""
+        self.closed = True
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                break
+
+
+def format_action(cdict):
+    """
+    Format an action dictionary as a manager command
+
+    List values are sent as repeated headers, see Manager.send_action.
+    """
+
+    clist = []
+
+    # generate the command
+    for key, value in cdict.items():
+        if isinstance(value, list):
+            for item in value:
+                clist.append("%s: %s" % (key, item))
+        else:
+            clist.append("%s: %s" % (key, value))
+    clist.append(EOL)
+    return EOL.join(clist)
+
+
+def _frame_key(item):
+    """Key of a received frame for coalescing: event name and channel"""
+    frame, name = item
+    channel = peek_header(frame, "Uniqueid") or peek_header(frame, "Channel")
+    return (name, channel) if channel is not None else None
+
+
+def _event_key(event):
+    """Key of an event for coalescing: event name and channel"""
+    channel = event.peek_header("Uniqueid") or event.peek_header("Channel")
+    return (event.name, channel) if channel is not None else None
+
+
+# actions only reading state, candidates for Manager coalesce_actions
+READ_ONLY_ACTIONS = (
+    "CoreShowChannels",
+    "DBGet",
+    "DBGetTree",
+    "ExtensionState",
+    "MailboxCount",
+    "MailboxStatus",
+    "QueueStatus",
+    "SIPshowpeer",
+    "Sippeers",
+    "Status",
+)
+
+
+def _chain(future):
+    """Return a new Future receiving the outcome of future"""
+
+    chained = Future()
+
+    def done(future):
+        if not chained.set_running_or_notify_cancel():
+            return
+        if future.cancelled():
+            chained.set_exception(ManagerException("Action cancelled"))
+        elif future.exception() is not None:
+            chained.set_exception(future.exception())
+        else:
+            chained.set_result(future.result())
+
+    future.add_done_callback(done)
+    return chained
+
+
+# synthetic events of the connection state, see Manager
+CONNECTION_LOST = "ConnectionLost"
+RECONNECTED = "Reconnected"
+
+
+def _state_event(name, **headers):
+    """Return a message queue item of a connection state event"""
+
+    lines = ["Event: %s\r\n" % name, "Privilege: system,all\r\n"]
+    lines.extend("%s: %s\r\n" % item for item in headers.items())
+    return ("".join(lines).encode(), name)
+
+
+class ManagerActions(object):
+    """
+    Manager action helpers.
+
+    The helpers only build the action and hand it to send_action, so they
+    are shared by Manager and AsyncManager: with the latter they return an
+    awaitable.
+    """
+
+    def _prepare_action(self, cdict, kwargs):
+        """Return the name, ActionID and bytes of an action"""
+
+        if isinstance(cdict, Action):
+            if kwargs:
+                raise TypeError("headers can not be added to an Action")
+            action_id = cdict.action_id or self.new_action_id()
+            return cdict.name, str(action_id), cdict.encode(action_id)
+
+        # fill in our args
+        cdict = dict(cdict)
+        cdict.update(kwargs)
+
+        # set the action id
+        if "ActionID" not in cdict:
+            cdict["ActionID"] = self.new_action_id()
+        return cdict.get("Action"), str(cdict["ActionID"]), format_action(cdict).encode()
+
+    def send(self, action):
+        """
+        Send an asterisk.actions.Action, returns its response or the
+        EventList of a list action
+        """
+
+        if action.list_action:
+            return self.send_list_action(action)
+        return self.send_action(action)
+
+    def ping(self):
+        """Send a ping action to the manager"""
+        return self.send(actions.Ping())
+
+    def logoff(self):
+        """Logoff from the manager"""
+        return self.send(actions.Logoff())
+
+    def hangup(self, channel):
+        """Hangup the specified channel"""
+        return self.send(actions.Hangup(channel=channel))
+
+    def status(self, channel=""):
+        """
+        Get a status message from asterisk
+
+        Returns an EventList with one Status event per channel.
+        """
+        return self.send(actions.Status(channel=channel))
+
+    def core_show_channels(self):
+        """List active channels, returns an EventList of CoreShowChannel events"""
+        return self.send(actions.CoreShowChannels())
+
+    def queue_status(self, queue="", member=""):
+        """Get the status of queues, returns an EventList"""
+        return self.send(actions.QueueStatus(queue=queue, member=member))
+
+    def db_get_tree(self, family="", key=""):
+        """Get the entries of an AstDB family, returns an EventList"""
+        return self.send(actions.DBGetTree(family=family, key=key))
+
+    def redirect(self, channel, exten, priority="1", extra_channel="", context=""):
+        """Redirect a channel"""
+        return self.send(actions.Redirect(
+            channel=channel,
+            exten=exten,
+            priority=priority,
+            extra_channel=extra_channel,
+            context=context,
+        ))
+
+    def originate(
+        self,
+        channel,
+        exten,
+        context="",
+        priority="",
+        timeout="",
+        caller_id="",
+        account="",
+        asynchronously=None,
+        variables={},
+    ):
+        """Originate a call"""
+        return self.send(actions.Originate(
+            channel=channel,
+            exten=exten,
+            context=context,
+            priority=priority,
+            timeout=timeout,
+            caller_id=caller_id,
+            account=account,
+            asynchronously=asynchronously or None,
+            variables=variables,
+        ))
+
+    def mailbox_status(self, mailbox):
+        """Get the status of the specfied mailbox"""
+        return self.send(actions.MailboxStatus(mailbox=mailbox))
+
+    def command(self, command):
+        """Execute a command"""
+        return self.send(actions.Command(command=command))
+
+    def extension_state(self, exten, context):
+        """Get the state of an extension"""
+        return self.send(actions.ExtensionState(exten=exten, context=context))
+
+    def playdtmf(self, channel, digit):
+        """Plays a dtmf digit on the specified channel"""
+        return self.send(actions.PlayDTMF(channel=channel, digit=digit))
+
+    def absolute_timeout(self, channel, timeout):
+        """Set an absolute timeout on a channel"""
+        return self.send(actions.AbsoluteTimeout(channel=channel, timeout=timeout))
+
+    def mailbox_count(self, mailbox):
+        return self.send(actions.MailboxCount(mailbox=mailbox))
+
+    def sippeers(self):
+        """List SIP peers, returns an EventList of PeerEntry events"""
+        return self.send(actions.Sippeers())
+
+    def sipshowpeer(self, peer):
+        return self.send(actions.SIPshowpeer(peer=peer))
+
+    def control_playback(self, channel: str, control: str):
+        return self.send(actions.ControlPlayback(channel=channel, control=control))
+
+
+class Manager(ManagerActions):
+    """
+    Threaded interface to the asterisk manager
+
+    With drop_unsubscribed, events nobody registered a callback for are
+    dropped by the receiving thread before they are parsed or queued,
+    dropped_events counts them by event name.  Events carrying an
+    ActionID answer our own actions and are always kept.
+
+    With server_filter, the events sent by asterisk are restricted to the
+    registered ones with the Events and Filter actions (asterisk 13 and
+    newer), see register_event.
+
+    With dispatch_workers, event callbacks run on that many worker
+    threads, see asterisk.dispatch.  The events of one call keep their
+    order, callbacks for different calls run in parallel.
+
+    With queue_size, the queues between the threads are bounded and
+    overflow decides what happens when they are full, see
+    asterisk.eventqueue.  Responses are never dropped, queue_stats
+    returns the sizes, high-water marks and drop counts.
+
+    With recorder, an asterisk.recorder.Recorder, all received messages
+    are recorded.
+
+    With metrics, an asterisk.metrics.Metrics, action round trip times,
+    callback run times, parse times and queue sizes are recorded.
+
+    timeout is the default number of seconds connect, login and
+    send_action wait before raising ManagerTimeoutException, None to
+    wait forever.  The response to an action that timed out is discarded
+    when it arrives.
+
+    With reconnect, a lost connection is connected again after
+    reconnect_delay seconds, doubled after every failed attempt up to
+    reconnect_max_delay, and the manager logs in again.  Callbacks stay
+    registered and event filters are restored.  Actions waiting for a
+    response fail with ManagerConnectionLostException, actions sent
+    while disconnected with ManagerException.  The events ConnectionLost
+    and Reconnected (see CONNECTION_LOST and RECONNECTED) are dispatched
+    to the callbacks registered for them.
+
+    With coalesce_actions, a list of action names like
+    READ_ONLY_ACTIONS, an action with the same headers as one of these
+    actions still waiting for its answer is not sent: it receives the
+    answer of the one in flight.  Actions with an ActionID of their own
+    are always sent.  coalesced_actions counts the saved actions by name.
+    """
+
+    def __init__(
+        self,
+        drop_unsubscribed=True,
+        server_filter=False,
+        dispatch_workers=0,
+        queue_size=0,
+        overflow="block",
+        drop_events=None,
+        metrics=None,
+        timeout=None,
+        reconnect=False,
+        reconnect_delay=0.5,
+        reconnect_max_delay=30.0,
+        coalesce_actions=None,
+    ):
         self._sock = None  # our socket
         self.title = None  # set by received greeting
         self._connected = threading.Event()
         self._running = threading.Event()
+        self.recorder = None
+        self.timeout = timeout
+        self.reconnect = reconnect
+        self.reconnect_delay = reconnect_delay
+        self.reconnect_max_delay = reconnect_max_delay
+        # where to connect and login again, failed attempts in a row
+        self._address = None
+        self._credentials = None
+        self._reconnects = 0
+        self._lost = False
+        self._closing = threading.Event()
+        self.metrics = metrics
+        if metrics is not None:
+            metrics.attach(self)
 
         # our hostname
         self.hostname = socket.gethostname()
 
         # our queues
-        self._message_queue = queue.Queue()
-        self._response_queue = queue.Queue()
-        self._event_queue = queue.Queue()
-
-        # callbacks for events
-        self._event_callbacks = {}
-
-        self._reswaiting = []  # who is waiting for a response
+        self._message_queue = EventQueue(
+            queue_size, overflow, drop_events, _frame_key if overflow == COALESCE else None
+        )
+        self._event_queue = EventQueue(
+            queue_size, overflow, drop_events, _event_key if overflow == COALESCE else None
+        )
+
+        # callbacks for events, replaced on every change
+        self._dispatch_table = DispatchTable()
+        self._register_lock = threading.Lock()
+        self._drop_unsubscribed = drop_unsubscribed
+        self.dropped_events = Counter()
+
+        # state of the event filters of our asterisk session, None
+        # until logged in
+        self._server_filter = server_filter
+        self._server_filters = None
+        self._server_events = None
+        self._filter_lock = threading.Lock()
+
+        # futures of actions waiting for a response, by ActionID
+        self._pending = {}
+        # collectors of list actions, by ActionID
+        self._lists = {}
+        # ActionIDs of list actions given up, their events are dropped
+        self._abandoned = set()
+        # streams of command output, by ActionID as bytes
+        self._streams = {}
+        # EventStreams to end when closing
+        self._event_streams = set()
+        self._pending_lock = threading.Lock()
+
+        # identical actions in flight are sent once
+        self.coalesce_actions = frozenset(name.lower() for name in coalesce_actions or ())
+        self.coalesced_actions = Counter()
+        # (Future, ActionID) of coalesced actions in flight, by key
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        self._greeting = Future()
+
+        # serializes writes of concurrent actions
+        self._sendlock = threading.Lock()
 
         # sequence stuff
         self._seqlock = threading.Lock()
@@ -191,6 +874,9 @@ class Manager(object):
         # some threads
         self.message_thread = threading.Thread(target=self.message_loop, daemon=True)
         self.event_dispatch_thread = threading.Thread(target=self.event_dispatch, daemon=True)
+        self._dispatcher = None
+        if dispatch_workers:
+            self._dispatcher = ShardedDispatcher(self._dispatch_event, dispatch_workers)
 
     def __del__(self):
         self.close()
@@ -210,9 +896,214 @@ class Manager(object):
             self._seq += 1
             self._seqlock.release()
 
-    def send_action(self, cdict={}, **kwargs):
+    def new_action_id(self):
+        """Return a new ActionID, for actions that need it before sending"""
+        return "%s-%08x" % (self.hostname, self.next_seq())
+
+    def submit_action(self, cdict={}, **kwargs):
+        """
+        Send a command to the manager without waiting for the response
+
+        Returns a concurrent.futures.Future that receives the response
+        carrying the ActionID of the command, so many actions may be in
+        flight on the connection at once.  See send_action for the
+        format of cdict, it may also be an asterisk.actions.Action.
+        """
+
+        return self._submit_shared(cdict, kwargs, False)[0]
+
+    def _submit_one(self, cdict, kwargs, list_action):
+        """Send an action, returns the Future of its answer and its ActionID"""
+
+        if list_action:
+            collector = _ListCollector()
+            action_id = self._submit_list(collector, cdict, kwargs)
+            return collector.future, action_id
+        name, action_id, data = self._prepare_action(cdict, kwargs)
+        return self._submit(name, action_id, data), action_id
+
+    def _submit_shared(self, cdict, kwargs, list_action):
+        """
+        Send an action like _submit_one, unless an identical one of
+        coalesce_actions is in flight: then wait for its answer
+        """
+
+        key = self._coalesce_key(cdict, kwargs, list_action) if self.coalesce_actions else None
+        if key is None:
+            return self._submit_one(cdict, kwargs, list_action)
+
+        with self._inflight_lock:
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                future, action_id = self._submit_one(cdict, kwargs, list_action)
+                # the Future, its ActionID and the number of callers
+                inflight = self._inflight[key] = [future, action_id, 0]
+                first = True
+            else:
+                self.coalesced_actions[key[0]] += 1
+                first = False
+            inflight[2] += 1
+        shared, action_id = inflight[0], inflight[1]
+
+        def forget(future):
+            with self._inflight_lock:
+                if self._inflight.get(key) is inflight:
+                    del self._inflight[key]
+
+        def leave(future):
+            # the last caller giving up cancels the action
+            if not future.cancelled():
+                return
+            with self._inflight_lock:
+                inflight[2] -= 1
+                if inflight[2]:
+                    return
+                if self._inflight.get(key) is inflight:
+                    del self._inflight[key]
+            shared.cancel()
+
+        if first:
+            shared.add_done_callback(forget)
+        # every caller gets its own future, one may cancel it on timeout
+        chained = _chain(shared)
+        chained.add_done_callback(leave)
+        return chained, action_id
+
+    def _coalesce_key(self, cdict, kwargs, list_action):
+        """Return the key of identical actions, None if not coalesced"""
+
+        if isinstance(cdict, Action):
+            if cdict.action_id is not None:
+                return None
+            headers = dict((field.header, getattr(cdict, field.attr)) for field in cdict.fields)
+            headers["Action"] = cdict.name
+        else:
+            headers = dict(cdict)
+            headers.update(kwargs)
+            if "ActionID" in headers:
+                return None
+        name = headers.get("Action")
+        if name is None or name.lower() not in self.coalesce_actions:
+            return None
+        # the same for dictionaries and Actions, empty headers are not
+        # sent; list actions are answered by EventLists
+        headers = tuple(sorted((k, str(v)) for k, v in headers.items() if v not in (None, "")))
+        return (name, list_action, headers)
+
+    def _submit(self, name, action_id, data):
+        """Send the bytes of an action, returns the Future of its response"""
+        return self._submit_many([(name, action_id, data)])[0]
+
+    def _submit_many(self, prepared):
+        """
+        Send prepared actions in one write, returns the Futures of their
+        responses
+        """
+
+        if not self._connected.is_set():
+            raise ManagerException("Not connected")
+
+        # register before sending, the response may be quicker than us
+        futures = [Future() for item in prepared]
+        with self._pending_lock:
+            action_ids = set()
+            for name, action_id, data in prepared:
+                if action_id in self._pending or action_id in action_ids:
+                    raise ManagerException("Duplicate ActionID %s" % action_id)
+                action_ids.add(action_id)
+            for (name, action_id, data), future in zip(prepared, futures):
+                self._pending[action_id] = future
+        for (name, action_id, data), future in zip(prepared, futures):
+            future.add_done_callback(self._forget_cancelled(action_id))
+        if self.metrics is not None:
+            for (name, action_id, data), future in zip(prepared, futures):
+                self.metrics.action_sent(name, future)
+
+        # lock the socket and send our commands
+        data = prepared[0][2] if len(prepared) == 1 else b"".join(item[2] for item in prepared)
+        try:
+            with self._sendlock:
+                self._sock.sendall(data)
+        except socket.error as e:
+            with self._pending_lock:
+                for action_id in action_ids:
+                    self._pending.pop(action_id, None)
+            raise ManagerSocketException(e.errno, e.strerror)
+
+        return futures
+
+    def _forget_cancelled(self, action_id):
+        """
+        Return a Future callback forgetting the action of a cancelled
+        Future, its late response is dropped
+        """
+
+        def done(future):
+            if not future.cancelled():
+                return
+            with self._pending_lock:
+                pending = self._pending.pop(action_id, None)
+                if self._lists.pop(action_id, None) is not None:
+                    self._abandoned.add(action_id)
+            # the response Future of a list action
+            if pending is not None:
+                pending.cancel()
+
+        return done
+
+    def submit_actions(self, actions):
+        """
+        Send many actions at once without waiting for the responses
+
+        The actions, dictionaries as for send_action or
+        asterisk.actions.Action objects, are written to the connection
+        in one go.  Returns the list of the Futures of their responses.
+        List actions are answered by their first response only, their
+        events are dispatched to the callbacks.
+        """
+
+        prepared = [self._prepare_action(action, {}) for action in actions]
+        if not prepared:
+            return []
+        return self._submit_many(prepared)
+
+    def send_actions(self, actions, timeout=None):
+        """
+        Send many actions at once and wait for all responses, see
+        submit_actions
+
+        Returns the list of the responses, in the order of the actions.
+        timeout is the time for all responses, see send_action.
+        """
+
+        prepared = [self._prepare_action(action, {}) for action in actions]
+        if not prepared:
+            return []
+        futures = self._submit_many(prepared)
+        if timeout is None:
+            timeout = self.timeout
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        responses = []
+        for (name, action_id, data), future in zip(prepared, futures):
+            if deadline is None:
+                responses.append(future.result())
+                continue
+            try:
+                responses.append(future.result(max(0, deadline - time.monotonic())))
+            except FutureTimeoutError:
+                for future in futures:
+                    future.cancel()
+                raise ManagerTimeoutException(
+                    "No response to %s within %s seconds" % (action_id, timeout)
+                )
+        return responses
+
+    def send_action(self, cdict={}, timeout=None, **kwargs):
         """
-        Send a command to the manager
+        Send a command to the manager and wait for its response
+
+        Waits at most timeout seconds, by default the timeout of the
+        manager, and raises ManagerTimeoutException then.
 
         If a list is passed to the cdict argument, each item in the list will
         be sent to asterisk under the same header in the following manner:
@@ -226,145 +1117,465 @@ class Manager(object):
         Action: Originate
         Variable: var1=value
         Variable: var2=value
+
+        cdict may also be an asterisk.actions.Action.
         """
 
-        if not self._connected.is_set():
-            raise ManagerException("Not connected")
+        future, action_id = self._submit_shared(cdict, kwargs, False)
+        return self._wait(future, action_id, timeout)
 
-        # fill in our args
-        cdict.update(kwargs)
+    def send(self, action, timeout=None):
+        """
+        Send an asterisk.actions.Action and wait for its response, or for
+        the EventList of a list action
+        """
 
-        # set the action id
-        if "ActionID" not in cdict:
-            cdict["ActionID"] = "%s-%08x" % (self.hostname, self.next_seq())
-        clist = []
-
-        # generate the command
-        for key, value in cdict.items():
-            if isinstance(value, list):
-                for item in value:
-                    item = tuple([key, item])
-                    clist.append("%s: %s" % item)
-            else:
-                item = tuple([key, value])
-                clist.append("%s: %s" % item)
-        clist.append(EOL)
-        command = EOL.join(clist)
+        if action.list_action:
+            return self.send_list_action(action, timeout)
+        return self.send_action(action, timeout)
 
-        # lock the socket and send our command
+    def _wait(self, future, action_id, timeout):
+        """Wait for the result of an action, see send_action"""
+
+        if timeout is None:
+            timeout = self.timeout
         try:
-            self._sock.write(command)
-            self._sock.flush()
-        except socket.error as e:
-            raise ManagerSocketException(e.errno, e.strerror)
+            return future.result(timeout)
+        except FutureTimeoutError:
+            # forgets the action, a late response is dropped
+            future.cancel()
+            raise ManagerTimeoutException("No response to %s within %s seconds" % (action_id, timeout))
 
-        self._reswaiting.insert(0, 1)
-        response = self._response_queue.get()
-        self._reswaiting.pop(0)
+    def _submit_list(self, collector, cdict, kwargs):
+        """Register collector for a list action and send it"""
 
-        if not response:
-            raise ManagerSocketException(0, "Connection Terminated")
+        name, action_id, data = self._prepare_action(cdict, kwargs)
 
-        return response
+        # events may arrive right after the response, register first
+        with self._pending_lock:
+            self._lists[action_id] = collector
+        collector.future.add_done_callback(self._forget_cancelled(action_id))
+        try:
+            future = self._submit(name, action_id, data)
+        except ManagerException:
+            with self._pending_lock:
+                self._lists.pop(action_id, None)
+            raise
+
+        def list_response(future):
+            if future.cancelled():
+                return
+            try:
+                done = collector.response(future.result())
+            except ManagerException as e:
+                collector.fail(e)
+                done = True
+            if done:
+                with self._pending_lock:
+                    self._lists.pop(action_id, None)
+
+        future.add_done_callback(list_response)
+        return action_id
+
+    def submit_list_action(self, cdict={}, **kwargs):
+        """
+        Send a list-style action without waiting for it
+
+        Returns a concurrent.futures.Future that receives an EventList
+        once the completion event of the list arrived.
+        """
+
+        return self._submit_shared(cdict, kwargs, True)[0]
+
+    def send_list_action(self, cdict={}, timeout=None, **kwargs):
+        """
+        Send a list-style action and collect its events
+
+        The events carrying the ActionID of the action are not dispatched
+        to the event callbacks but collected in the returned EventList.
+        If the response does not announce an EventList (older asterisk
+        versions) it is returned without events.  timeout is the time for
+        the whole list, see send_action.
+        """
+
+        future, action_id = self._submit_shared(cdict, kwargs, True)
+        return self._wait(future, action_id, timeout)
+
+    def iter_list_action(self, cdict={}, maxsize=1000, **kwargs):
+        """
+        Send a list-style action and iterate over its events as they
+        arrive
+
+        At most maxsize events are buffered, reading from the connection
+        stops while the consumer falls behind.  The completion event is
+        not returned.  Raises ManagerException if asterisk responds with
+        an error.
+        """
+
+        stream = _ListStream(maxsize)
+        self._submit_list(stream, cdict, kwargs)
+        return self._iter_list(stream)
+
+    def _iter_list(self, stream):
+        try:
+            while True:
+                event = stream.queue.get()
+                if event is None:
+                    break
+                yield event
+            result = stream.future.result()
+            if result.get_header("Response") == "Error":
+                raise ManagerException(result.get_header("Message"))
+        finally:
+            stream.close()
+
+    def command_lines(self, command, maxsize=16):
+        """
+        Execute a command and iterate over the lines of its output as they
+        arrive
+
+        Unlike command, the output is not collected: the reading thread
+        hands it over in chunks of complete lines, at most maxsize chunks
+        are buffered and reading from the connection stops while the
+        consumer falls behind.  Raises ManagerException if asterisk
+        responds with an error.
+        """
+
+        action_id = self.new_action_id()
+        stream = _CommandStream(maxsize)
+        # the response may arrive right after sending, register first
+        with self._pending_lock:
+            self._streams[action_id.encode()] = stream
+        try:
+            self.submit_action({"Action": "Command", "Command": command, "ActionID": action_id})
+        except ManagerException:
+            with self._pending_lock:
+                self._streams.pop(action_id.encode(), None)
+            raise
+        return self._iter_command(action_id, stream)
+
+    def _iter_command(self, action_id, stream):
+        headers = []
+        follows = False
+        try:
+            while True:
+                data = stream.queue.get()
+                if data is None:
+                    break
+                lines = data.decode("utf-8", "replace").split("\n")
+                # chunks end with a line end
+                lines.pop()
+                for line in lines:
+                    line = line.rstrip("\r")
+                    if headers is not None:
+                        name, sep, value = line.partition(": ")
+                        if sep and name in _COMMAND_HEADERS:
+                            headers.append(line + "\r\n")
+                            if name == "Response":
+                                follows = value == "Follows"
+                            continue
+                        response = ManagerMsg(headers)
+                        headers = None
+                    if not follows:
+                        if line.startswith("Output: "):
+                            line = line[8:]
+                    elif line.endswith(END_COMMAND_TEXT):
+                        line = line[: -len(END_COMMAND_TEXT)]
+                        if not line:
+                            continue
+                    yield line
+            if stream.error is not None:
+                raise stream.error
+            if headers is not None:
+                response = ManagerMsg(headers)
+            if response.get_header("Response") == "Error":
+                raise ManagerException(response.get_header("Message"))
+        finally:
+            stream.close()
+            with self._pending_lock:
+                self._streams.pop(action_id.encode(), None)
+                future = self._pending.pop(action_id, None)
+            if future is not None:
+                # nobody waits for it, the response went to the stream
+                future.cancel()
+
+    def _handle_response(self, message):
+        """Hand a response to the action waiting for it"""
+
+        action_id = message.get_header("ActionID")
+        with self._pending_lock:
+            future = self._pending.pop(action_id, None)
+            # some commands do not return the ActionID, hand those to
+            # the oldest action still waiting
+            if future is None and action_id is None:
+                for key, pending in self._pending.items():
+                    if not pending.cancelled():
+                        future = self._pending.pop(key)
+                        break
+
+        # a list action given up before its response, the list follows
+        # only when the response announces it
+        if future is None and action_id in self._abandoned and not is_list_response(message):
+            with self._pending_lock:
+                self._abandoned.discard(action_id)
+
+        # responses nobody waits for are dropped
+        if future is not None and future.set_running_or_notify_cancel():
+            future.set_result(message)
+
+    def _fail_pending(self, error):
+        """Fail all actions waiting for a response"""
+
+        with self._pending_lock:
+            futures = list(self._pending.values())
+            self._pending.clear()
+            collectors = list(self._lists.values())
+            self._lists.clear()
+            self._abandoned.clear()
+            collectors.extend(self._streams.values())
+            self._streams.clear()
+        if not self._greeting.done():
+            futures.append(self._greeting)
+        for future in futures:
+            if future.set_running_or_notify_cancel():
+                future.set_exception(error)
+        for collector in collectors:
+            collector.fail(error)
+
+    def _handle_event(self, event):
+        """Hand an event to its list action or to the event dispatcher"""
+
+        action_id = event.peek_header("ActionID")
+        if action_id is not None:
+            collector = self._lists.get(action_id)
+            if collector is not None:
+                if collector.event(event):
+                    with self._pending_lock:
+                        self._lists.pop(action_id, None)
+                return
+            if action_id in self._abandoned:
+                # late events of a list nobody waits for
+                if is_list_complete(event):
+                    with self._pending_lock:
+                        self._abandoned.discard(action_id)
+                return
+            self._event_queue.put(event)
+        else:
+            self._event_queue.put(event, event.name)
 
     def _receive_data(self):
         """
-        Read the response from a command.
+        Read data from the socket and split it into messages, connect
+        again when the connection is lost and we reconnect.
         """
 
-        multiline = False
-        status = False
-        wait_for_marker = False
+        while True:
+            self._read_connection()
+            if not self.reconnect or self._closing.is_set() or not self._running.is_set():
+                break
+            self._fail_pending(ManagerConnectionLostException(0, "Connection lost"))
+            if not self._lost:
+                self._lost = True
+                self._message_queue.put(_state_event(CONNECTION_LOST, Reason="Connection lost"))
+            if not self._reconnect_socket():
+                break
+        self._message_queue.put(None)
+
+    def _read_connection(self):
+        """Read from the socket until the connection is closed"""
+
+        parser = FrameParser(streams=self._streams)
+        # the greeting of this connection, messages of an older one may
+        # still be queued
+        greeting = self._greeting
+        buf = bytearray(RECV_SIZE)
+        view = memoryview(buf)
         # loop while we are sill running and connected
         while self._running.is_set() and self._connected.is_set():
             try:
-                lines = []
-                for line in self._sock:
-                    # check to see if this is the greeting line
-                    if not self.title and "/" in line and not ":" in line:
-                        # store the title of the manager we are connecting to:
-                        self.title = line.split("/")[0].strip()
-                        # store the version of the manager we are connecting to:
-                        self.version = line.split("/")[1].strip()
-                        # fake message header
-                        lines.append("Response: Generated Header\r\n")
-                        lines.append(line)
-                        break
-                    # If the line is EOL marker we have a complete message.
-                    # Some commands are broken and contain a \n\r\n
-                    # sequence, in the case wait_for_marker is set, we
-                    # have such a command where the data ends with the
-                    # marker --END COMMAND--, so we ignore embedded
-                    # newlines until we see that marker
-                    if line == EOL and not wait_for_marker:
-                        multiline = False
-                        if lines or not self._connected.is_set():
-                            break
-                        # ignore empty lines at start
-                        continue
-                    # If the user executed the status command, it's a special
-                    # case, so we need to look for a marker.
-                    if "status will follow" in line:
-                        status = True
-                        wait_for_marker = True
-                    lines.append(line)
-
-                    # line not ending in \r\n or without ':' isn't a
-                    # valid header and starts multiline response
-                    if not line.endswith(EOL) or ":" not in line:
-                        multiline = True
-                    # Response: Follows indicates we should wait for end
-                    # marker --END COMMAND--
-                    if (
-                        not (multiline or status)
-                        and line.startswith("Response")
-                        and line.split(":", 1)[1].strip() == "Follows"
-                    ):
-                        wait_for_marker = True
-                    # same when seeing end of multiline response
-                    if multiline and line.startswith("--END COMMAND--"):
-                        wait_for_marker = False
-                        multiline = False
-                    # same when seeing end of status response
-                    if status and "StatusComplete" in line:
-                        wait_for_marker = False
-                        status = False
-                    if not self._connected.is_set():
-                        break
-                else:
-                    # EOF during reading
-                    self._sock.close()
-                    self._connected.clear()
-                # if we have a message append it to our queue
-                if lines and self._connected.is_set():
-                    self._message_queue.put(lines)
+                n = self._sock.recv_into(buf)
+            except socket.error:
+                break
+            if not n:
+                # EOF during reading
+                break
+            frames = parser.feed(view[:n])
+            if self.title is None and parser.title is not None:
+                # store the title and version of the manager we are
+                # connecting to:
+                self.title = parser.title
+                self.version = parser.version
+            recorder = self.recorder
+            # append our messages to our queue
+            for frame in frames:
+                if recorder is not None:
+                    recorder.write(frame)
+                if greeting is not None and frame.startswith(GREETING_HEADER):
+                    if not greeting.done():
+                        greeting.set_result(ManagerMsg.from_frame(frame))
+                    greeting = None
+                    continue
+                name = peek_event(frame)
+                if (
+                    name is not None
+                    and self._drop_unsubscribed
+                    and not self._dispatch_table.callbacks(name)
+                    and not has_action_id(frame)
+                ):
+                    self.dropped_events[name] += 1
+                    continue
+                if name is not None and not has_action_id(frame):
+                    # may be dropped when the queue is full
+                    self._message_queue.put((frame, name), name)
                 else:
-                    self._message_queue.put(None)
+                    self._message_queue.put((frame, name))
+        self._sock.close()
+        self._connected.clear()
+
+    def _reconnect_socket(self):
+        """
+        Connect again with exponential backoff and log in on another
+        thread, returns False when closing
+        """
+
+        host, port = self._address
+        while True:
+            delay = min(self.reconnect_delay * 2 ** self._reconnects, self.reconnect_max_delay)
+            self._reconnects += 1
+            if self._closing.wait(delay):
+                return False
+            try:
+                sock = socket.create_connection((host, port), self.timeout)
+                sock.settimeout(None)
+            except socket.error:
+                continue
+            # the next response is the greeting of the new connection
+            self._greeting = Future()
+            self._sock = sock
+            self._connected.set()
+            threading.Thread(target=self._relogin, daemon=True).start()
+            return True
+
+    def _relogin(self):
+        """Log in on a new connection, closes it again on failure"""
+
+        try:
+            self._greeting.result(self.timeout)
+            if self._credentials is not None:
+                self.login(*self._credentials)
+        except (ManagerException, FutureTimeoutError):
+            try:
+                self._sock.shutdown(socket.SHUT_RDWR)
             except socket.error:
-                self._sock.close()
-                self._connected.clear()
-                self._message_queue.put(None)
+                pass
+            return
+        self._reconnects = 0
+        self._lost = False
+        self._message_queue.put(_state_event(RECONNECTED))
+
+    def queue_stats(self):
+        """
+        Return the statistics of the message and the event queue, see
+        EventQueue.stats.  Events dropped in the queues are not counted in
+        dropped_events.
+        """
+
+        return {
+            "message": self._message_queue.stats(),
+            "event": self._event_queue.stats(),
+        }
 
-    def register_event(self, event, function):
+    def events(self, filter="*", maxsize=1000, overflow="block", headers=None):
+        """
+        Return an iterator over the events matching filter, see
+        asterisk.eventstream.  filter and headers are as for
+        register_event, maxsize and overflow bound the queue of the
+        iterator.
+        """
+
+        from asterisk.eventstream import EventStream
+
+        return EventStream(self, filter, maxsize, overflow, headers)
+
+    def register_event(self, event, function, headers=None):
         """
         Register a callback for the specfied event.
         If a callback function returns True, no more callbacks for that
         event will be executed.
+
+        event may be a glob pattern like 'Queue*', '*' registers for all
+        events.  The callbacks for the event name run first, then the
+        ones of matching patterns, then the ones for '*'.
+
+        With headers, a dictionary of header names and values, the
+        callback is only called for events carrying these values.
+
+        With server_filter, asterisk is told to send the event.  Asterisk
+        filters can not be removed, after unregistering the events are
+        still sent (and dropped here) until no callback is left at all.
         """
 
-        # get the current value, or an empty list
-        # then add our new callback
-        current_callbacks = self._event_callbacks.get(event, [])
-        current_callbacks.append(function)
-        self._event_callbacks[event] = current_callbacks
+        if headers:
+            function = _HeaderFilter(function, headers)
+
+        # threads dispatching events keep using the old table
+        with self._register_lock:
+            self._dispatch_table = self._dispatch_table.register(event, function)
+        self._sync_server_filter()
 
-    def unregister_event(self, event, function):
+    def unregister_event(self, event, function, headers=None):
         """
         Unregister a callback for the specified event.
         """
-        current_callbacks = self._event_callbacks.get(event, [])
-        current_callbacks.remove(function)
-        self._event_callbacks[event] = current_callbacks
+        with self._register_lock:
+            table = self._dispatch_table
+            if headers:
+                for name, callback in table.registrations:
+                    if (
+                        name == event
+                        and isinstance(callback, _HeaderFilter)
+                        and callback.function == function
+                        and dict(callback.headers) == headers
+                    ):
+                        function = callback
+                        break
+            self._dispatch_table = table.unregister(event, function)
+        self._sync_server_filter()
+
+    def _sync_server_filter(self):
+        """Bring the event filters of our asterisk session up to date"""
+
+        if not self._server_filter:
+            return
+        with self._filter_lock:
+            if self._server_filters is None or not self._connected.is_set():
+                return
+
+            wanted = set()
+            for event, callback in self._dispatch_table.registrations:
+                if event == "*":
+                    wanted.add(".")
+                elif isinstance(callback, _HeaderFilter):
+                    wanted.add(filter_regex(event, dict(callback.headers)))
+                else:
+                    wanted.add(filter_regex(event))
+
+            # without any filter asterisk sends everything, switch
+            # events off instead
+            actions = []
+            if bool(wanted) != self._server_events:
+                self._server_events = bool(wanted)
+                actions.append({"Action": "Events", "EventMask": "on" if wanted else "off"})
+            for regex in sorted(wanted - self._server_filters):
+                actions.append({"Action": "Filter", "Operation": "Add", "Filter": regex})
+            self._server_filters |= wanted
+
+            # do not wait, we may be called from an event callback
+            for cdict in actions:
+                try:
+                    self.submit_action(cdict)
+                except ManagerException:
+                    break
 
     def message_loop(self):
         """
@@ -381,65 +1592,118 @@ class Manager(object):
             # loop getting messages from the queue
             while self._running.is_set():
                 # get/wait for messages
-                data = self._message_queue.get()
+                item = self._message_queue.get()
 
                 # if we got None as our message we are done
-                if not data:
-                    # notify the other queues
+                if item is None:
+                    # notify the event queue and the waiting actions
                     self._event_queue.put(None)
-                    for waiter in self._reswaiting:
-                        self._response_queue.put(None)
+                    self._fail_pending(ManagerSocketException(0, "Connection Terminated"))
                     break
 
+                # events are parsed when their headers are accessed
+                data, name = item
+                if name is not None:
+                    self._handle_event(Event(ManagerMsg.from_frame(data), name))
+                    continue
+
                 # parse the data
-                message = ManagerMsg(data)
+                message = ManagerMsg.from_frame(data)
+                if self.metrics is not None:
+                    self._parse(message)
 
                 # check if this is an event message
                 if message.has_header("Event"):
-                    self._event_queue.put(Event(message))
+                    self._handle_event(Event(message))
                 # check if this is a response
                 elif message.has_header("Response"):
-                    self._response_queue.put(message)
+                    self._handle_response(message)
                 else:
                     print("No clue what we got\n{}".format(message.data))
         finally:
             # wait for our data receiving thread to exit
             t.join()
 
-    def event_dispatch(self):
-        """This thread is responsible for dispatching events"""
+    def _parse(self, message):
+        """Parse a message now, recording the time taken in the metrics"""
+
+        start = time.perf_counter()
+        message.parse()
+        self.metrics.parse.observe(time.perf_counter() - start)
 
-        # loop dispatching events
-        while self._running.is_set():
-            # get/wait for an event
-            ev = self._event_queue.get()
+    def _dispatch_event(self, ev):
+        """Run the callbacks of an event"""
 
-            # if we got None as an event, we are finished
-            if not ev:
+        callbacks = self._dispatch_table.callbacks(ev.name)
+
+        metrics = self.metrics
+        if metrics is not None:
+            # parsed up front to time it, the callbacks would parse it
+            if callbacks and ev.message._headers is None:
+                self._parse(ev.message)
+            for callback in callbacks:
+                start = time.perf_counter()
+                result = callback(ev, self)
+                metrics.callback_done(callback, ev, time.perf_counter() - start)
+                if result:
+                    break
+            return
+
+        # now execute the functions
+        for callback in callbacks:
+            if callback(ev, self):
                 break
 
-            # dispatch our events
+    def event_dispatch(self):
+        """This thread is responsible for dispatching events"""
+
+        dispatcher = self._dispatcher
+        if dispatcher is not None:
+            dispatcher.start()
 
-            # first build a list of the functions to execute
-            callbacks = self._event_callbacks.get(ev.name, []) + self._event_callbacks.get("*", [])
+        try:
+            # loop dispatching events
+            while self._running.is_set():
+                # get/wait for an event
+                ev = self._event_queue.get()
 
-            # now execute the functions
-            for callback in callbacks:
-                if callback(ev, self):
+                # if we got None as an event, we are finished
+                if not ev:
                     break
 
-    def connect(self, host, port=5038):
-        """Connect to the manager interface"""
+                # dispatch our events
+                if dispatcher is not None:
+                    dispatcher.put(ev)
+                else:
+                    self._dispatch_event(ev)
+        finally:
+            if dispatcher is not None:
+                dispatcher.stop()
+
+    def connect(self, host, port=5038, timeout=None):
+        """
+        Connect to the manager interface
+
+        Waits at most timeout seconds, by default the timeout of the
+        manager, for the connection and again for the greeting.
+        """
 
         if self._connected.is_set():
             raise ManagerException("Already connected to manager")
+        if timeout is None:
+            timeout = self.timeout
+        self._address = (host, int(port))
 
         # create our socket and connect
         try:
             _sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            _sock.settimeout(timeout)
             _sock.connect((host, int(port)))
-            self._sock = _sock.makefile("rw")
+            _sock.settimeout(None)
+            self._sock = _sock
+        except socket.timeout:
             _sock.close()
+            raise ManagerTimeoutException("No connection within %s seconds" % timeout)
         except socket.error as e:
             raise ManagerSocketException(e.errno, e.strerror)
 
@@ -454,11 +1718,23 @@ class Manager(object):
         self.event_dispatch_thread.start()
 
         # get our initial connection response
-        return self._response_queue.get()
+        try:
+            return self._greeting.result(timeout)
+        except FutureTimeoutError:
+            # end our threads, close still has to be called
+            self._connected.clear()
+            try:
+                self._sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            raise ManagerTimeoutException("No greeting within %s seconds" % timeout)
 
     def close(self):
         """Shutdown the connection to the manager"""
 
+        # do not connect again
+        self._closing.set()
+
         # if we are still running, logout
         if self._running.is_set() and self._connected.is_set():
             self.logoff()
@@ -471,187 +1747,50 @@ class Manager(object):
             self.message_thread.join()
 
             # make sure we do not join our self (when close is called from event handlers)
-            if threading.current_thread() != self.event_dispatch_thread:
+            current = threading.current_thread()
+            if current != self.event_dispatch_thread and not (
+                self._dispatcher is not None and self._dispatcher.is_worker(current)
+            ):
                 # wait for the dispatch thread to exit
                 self.event_dispatch_thread.join()
 
         self._running.clear()
+        for stream in list(self._event_streams):
+            stream.close()
 
-    # Manager actions
-
-    def login(self, username, secret):
+    def login(self, username, secret, timeout=None):
         """Login to the manager, throws ManagerAuthException when login falis"""
 
-        cdict = {"Action": "Login"}
-        cdict["Username"] = username
-        cdict["Secret"] = secret
-        response = self.send_action(cdict)
+        response = self.send(actions.Login(username=username, secret=secret), timeout)
 
         if response.get_header("Response") == "Error":
             raise ManagerAuthException(response.get_header("Message"))
+        self._credentials = (username, secret)
 
-        return response
-
-    def ping(self):
-        """Send a ping action to the manager"""
-        cdict = {"Action": "Ping"}
-        return self.send_action(cdict)
-
-    def logoff(self):
-        """Logoff from the manager"""
-
-        cdict = {"Action": "Logoff"}
-        return self.send_action(cdict)
-
-    def hangup(self, channel):
-        """Hangup the specified channel"""
-
-        cdict = {"Action": "Hangup"}
-        cdict["Channel"] = channel
-        return self.send_action(cdict)
-
-    def status(self, channel=""):
-        """Get a status message from asterisk"""
-
-        cdict = {"Action": "Status"}
-        cdict["Channel"] = channel
-        response = self.send_action(cdict)
-
-        return response
-
-    def redirect(self, channel, exten, priority="1", extra_channel="", context=""):
-        """Redirect a channel"""
-
-        cdict = {"Action": "Redirect"}
-        cdict["Channel"] = channel
-        cdict["Exten"] = exten
-        cdict["Priority"] = priority
-        if context:
-            cdict["Context"] = context
-        if extra_channel:
-            cdict["ExtraChannel"] = extra_channel
-        response = self.send_action(cdict)
-
-        return response
-
-    def originate(
-        self,
-        channel,
-        exten,
-        context="",
-        priority="",
-        timeout="",
-        caller_id="",
-        account="",
-        asynchronously=None,
-        variables={},
-    ):
-        """Originate a call"""
-
-        cdict = {"Action": "Originate"}
-        cdict["Channel"] = channel
-        cdict["Exten"] = exten
-        if context:
-            cdict["Context"] = context
-        if priority:
-            cdict["Priority"] = priority
-        if timeout:
-            cdict["Timeout"] = timeout
-        if caller_id:
-            cdict["CallerID"] = caller_id
-        if account:
-            cdict["Account"] = account
-        if asynchronously:
-            cdict["Async"] = asynchronously
-        # join dict of vairables together in a string in the form of 'key=val|key=val'
-        # with the latest CVS HEAD this is no longer necessary
-        # if variables: cdict['Variable'] = '|'.join(['='.join((str(key), str(value))) for key, value in variables.items()])
-        if variables:
-            cdict["Variable"] = ["=".join((str(key), str(value))) for key, value in variables.items()]
-
-        response = self.send_action(cdict)
+        # a new session has no filters
+        with self._filter_lock:
+            self._server_filters = set()
+            self._server_events = None
+        self._sync_server_filter()
 
         return response
 
-    def mailbox_status(self, mailbox):
-        """Get the status of the specfied mailbox"""
-
-        cdict = {"Action": "MailboxStatus"}
-        cdict["Mailbox"] = mailbox
-        response = self.send_action(cdict)
-
-        return response
-
-    def command(self, command):
-        """Execute a command"""
-
-        cdict = {"Action": "Command"}
-        cdict["Command"] = command
-        response = self.send_action(cdict)
-
-        return response
-
-    def extension_state(self, exten, context):
-        """Get the state of an extension"""
-
-        cdict = {"Action": "ExtensionState"}
-        cdict["Exten"] = exten
-        cdict["Context"] = context
-        response = self.send_action(cdict)
-
-        return response
-
-    def playdtmf(self, channel, digit):
-        """Plays a dtmf digit on the specified channel"""
-
-        cdict = {"Action": "PlayDTMF"}
-        cdict["Channel"] = channel
-        cdict["Digit"] = digit
-        response = self.send_action(cdict)
 
-        return response
-
-    def absolute_timeout(self, channel, timeout):
-        """Set an absolute timeout on a channel"""
-
-        cdict = {"Action": "AbsoluteTimeout"}
-        cdict["Channel"] = channel
-        cdict["Timeout"] = timeout
-        response = self.send_action(cdict)
-        return response
-
-    def mailbox_count(self, mailbox):
-        cdict = {"Action": "MailboxCount"}
-        cdict["Mailbox"] = mailbox
-        response = self.send_action(cdict)
-        return response
-
-    def sippeers(self):
-        cdict = {"Action": "Sippeers"}
-        response = self.send_action(cdict)
-        return response
+class ManagerException(Exception):
+    pass
 
-    def sipshowpeer(self, peer):
-        cdict = {"Action": "SIPshowpeer"}
-        cdict["Peer"] = peer
-        response = self.send_action(cdict)
-        return response
 
-    def control_playback(self, channel: str, control: str):
-        cdict = {"Action": "ControlPlayback"}
-        cdict["Channel"] = channel
-        cdict["Control"] = control
-        response = self.send_action(cdict)
-        return response
+class ManagerSocketException(ManagerException):
+    pass
 
 
-class ManagerException(Exception):
+class ManagerAuthException(ManagerException):
     pass
 
 
-class ManagerSocketException(ManagerException):
+class ManagerConnectionLostException(ManagerSocketException):
     pass
 
 
-class ManagerAuthException(ManagerException):
+class ManagerTimeoutException(ManagerException):
     pass
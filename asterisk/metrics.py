@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# vim: set expandtab shiftwidth=4:
+
+"""
+Instrumentation of the Manager
+
+A Metrics object passed to a Manager records where the time goes:
+
+ * the round trip time of actions, by action name
+ * the run time of event callbacks, by callback
+ * the time spent parsing messages
+ * the sizes of the message and event queues and the dropped events
+
+   import asterisk.manager
+   import asterisk.metrics
+
+   metrics = asterisk.metrics.Metrics(slow_callback=0.05)
+   manager = asterisk.manager.Manager(metrics=metrics)
+   ...
+   print(metrics.prometheus())
+
+Callbacks running longer than slow_callback seconds are counted in
+slow_callbacks and reported to slow_callback_handler when it is set.
+Times are in seconds.  Without metrics the Manager does not measure
+anything.  Parse times are recorded for the responses and for the events
+dispatched to callbacks, these are parsed before the callbacks run.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+
+# upper bounds of the histogram buckets, in seconds
+DEFAULT_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+    0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+class Histogram(object):
+    """Counts of observed values by bucket, with their sum"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        # the last count is for values above all buckets
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        """Return the cumulative bucket counts, sum and count"""
+
+        with self._lock:
+            counts = list(self.counts)
+            total, count = self.sum, self.count
+        cumulative = []
+        n = 0
+        for bound, c in zip(self.buckets + (float("inf"),), counts):
+            n += c
+            cumulative.append((bound, n))
+        return {"buckets": cumulative, "sum": total, "count": count}
+
+
+def callback_name(callback):
+    """Return a readable name of an event callback"""
+
+    callback = getattr(callback, "__wrapped__", callback)
+    name = getattr(callback, "__qualname__", None) or type(callback).__qualname__
+    module = getattr(callback, "__module__", None)
+    return "%s.%s" % (module, name) if module else name
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metrics(object):
+    """
+    Latency histograms and counters of one Manager
+
+    slow_callback is the run time in seconds from which a callback is
+    counted as slow, None to not look for slow callbacks.
+    slow_callback_handler is called as handler(name, event, seconds) for
+    each slow run, on the thread running the callback.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, slow_callback=0.1):
+        self.buckets = buckets
+        self.slow_callback = slow_callback
+        self.slow_callback_handler = None
+        self.manager = None
+
+        self.actions = {}
+        self.callbacks = {}
+        self.parse = Histogram(buckets)
+        self.slow_callbacks = Counter()
+        self._names = {}
+        self._lock = threading.Lock()
+
+    def attach(self, manager):
+        """Take the queue statistics from manager"""
+        self.manager = manager
+
+    def _histogram(self, histograms, key):
+        histogram = histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = histograms.setdefault(key, Histogram(self.buckets))
+        return histogram
+
+    def action_sent(self, action, future):
+        """Measure the time until future receives the response of action"""
+
+        start = time.perf_counter()
+        histogram = self._histogram(self.actions, action)
+
+        def done(future):
+            if not future.cancelled() and future.exception() is None:
+                histogram.observe(time.perf_counter() - start)
+
+        future.add_done_callback(done)
+
+    def callback_done(self, callback, event, seconds):
+        """Record the run time of an event callback"""
+
+        name = self._names.get(callback)
+        if name is None:
+            name = self._names[callback] = callback_name(callback)
+        self._histogram(self.callbacks, name).observe(seconds)
+        if self.slow_callback is not None and seconds >= self.slow_callback:
+            self.slow_callbacks[name] += 1
+            if self.slow_callback_handler is not None:
+                self.slow_callback_handler(name, event, seconds)
+
+    def snapshot(self):
+        """Return all metrics as a dictionary"""
+
+        snapshot = {
+            "actions": dict((k, h.snapshot()) for k, h in list(self.actions.items())),
+            "callbacks": dict((k, h.snapshot()) for k, h in list(self.callbacks.items())),
+            "parse": self.parse.snapshot(),
+            "slow_callbacks": dict(self.slow_callbacks),
+        }
+        if self.manager is not None:
+            snapshot["queues"] = self.manager.queue_stats()
+            snapshot["dropped_events"] = dict(self.manager.dropped_events)
+        return snapshot
+
+    def prometheus(self, prefix="pyst"):
+        """Return the metrics in the Prometheus text exposition format"""
+
+        snapshot = self.snapshot()
+        lines = []
+
+        def histogram(name, help, label, histograms):
+            lines.append("# HELP %s_%s %s" % (prefix, name, help))
+            lines.append("# TYPE %s_%s histogram" % (prefix, name))
+            for key, h in sorted(histograms.items()):
+                labels = '%s="%s",' % (label, _label(key)) if label else ""
+                for bound, count in h["buckets"]:
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append('%s_%s_bucket{%sle="%s"} %d' % (prefix, name, labels, le, count))
+                labels = "{%s}" % labels[:-1] if labels else ""
+                lines.append("%s_%s_sum%s %r" % (prefix, name, labels, h["sum"]))
+                lines.append("%s_%s_count%s %d" % (prefix, name, labels, h["count"]))
+
+        def metric(name, kind, help, samples):
+            lines.append("# HELP %s_%s %s" % (prefix, name, help))
+            lines.append("# TYPE %s_%s %s" % (prefix, name, kind))
+            for labels, value in samples:
+                labels = ",".join('%s="%s"' % (k, _label(v)) for k, v in labels)
+                lines.append("%s_%s{%s} %s" % (prefix, name, labels, value))
+
+        histogram(
+            "action_latency_seconds", "Round trip time of manager actions",
+            "action", snapshot["actions"],
+        )
+        histogram(
+            "callback_seconds", "Run time of event callbacks",
+            "callback", snapshot["callbacks"],
+        )
+        histogram("parse_seconds", "Time spent parsing messages", None, {"": snapshot["parse"]})
+        metric(
+            "slow_callbacks_total", "counter", "Event callbacks running longer than the limit",
+            [((("callback", k),), v) for k, v in sorted(snapshot["slow_callbacks"].items())],
+        )
+        if "queues" in snapshot:
+            queues = sorted(snapshot["queues"].items())
+            metric(
+                "queue_size", "gauge", "Items waiting in the manager queues",
+                [((("queue", q),), s["size"]) for q, s in queues],
+            )
+            metric(
+                "queue_high_water", "gauge", "Largest size of the manager queues",
+                [((("queue", q),), s["high_water"]) for q, s in queues],
+            )
+            metric(
+                "queue_dropped_total", "counter", "Events dropped by full queues",
+                [
+                    ((("queue", q), ("event", e)), n)
+                    for q, s in queues
+                    for e, n in sorted(s["dropped"].items())
+                ],
+            )
+            metric(
+                "dropped_events_total", "counter", "Events dropped without a callback",
+                [((("event", e),), n) for e, n in sorted(snapshot["dropped_events"].items())],
+            )
+        return "\n".join(lines) + "\n"
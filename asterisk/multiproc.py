@@ -0,0 +1,321 @@
+#!/usr/bin/env python
+# vim: set expandtab shiftwidth=4:
+
+"""
+Dispatching manager events to worker processes
+
+With a ProcessDispatcher one Manager connection reads the events and a
+pool of worker processes runs the callbacks, so CPU bound callbacks are
+not limited to one core.  Events are sharded by call like with
+asterisk.dispatch: all events with the same Linkedid (or Uniqueid) go to
+the same worker, in order.  Events are passed as their raw frames over a
+pipe per worker and parsed in the worker.  A worker buffers at most
+queue_size events, when it falls further behind its pipe fills and the
+event dispatch thread of the manager waits for it.
+
+The callbacks are registered in the workers by a setup function, called
+in each worker process with its Worker.  A Worker has the action helpers
+of the Manager, its actions are sent over the connection of the parent:
+
+   import asterisk.manager
+   import asterisk.multiproc
+
+   def rate_call(event, worker):
+      ...
+      worker.send_action({'Action': 'UserEvent', 'UserEvent': 'Rated'})
+
+   def setup(worker):
+      worker.register_event('Hangup', rate_call)
+
+   manager = asterisk.manager.Manager()
+   manager.connect('host')
+   manager.login('user', 'secret')
+
+   pool = asterisk.multiproc.ProcessDispatcher(manager, setup, workers=4,
+                                               events=('Hangup', 'Cdr'))
+   pool.start()
+   ...
+   pool.stop()
+
+setup and the callbacks must be picklable (module level functions) where
+processes are not forked.  Only the events listed in events are sent to
+the workers, '*' sends all.
+"""
+
+import itertools
+import multiprocessing
+import multiprocessing.connection
+import pickle
+import queue
+import threading
+import traceback
+from concurrent.futures import Future
+
+from asterisk.actions import Action
+from asterisk.dispatch import DispatchTable, shard_key
+from asterisk.framing import peek_event
+from asterisk.manager import (
+    Event,
+    EventList,
+    ManagerActions,
+    ManagerException,
+    ManagerMsg,
+    _HeaderFilter,
+)
+
+def _frames(message):
+    """Return the frames of a response or an EventList"""
+
+    if isinstance(message, EventList):
+        complete = message.complete.message.frame if message.complete is not None else None
+        return (message.response.frame, [event.message.frame for event in message], complete)
+    return message.frame
+
+
+def _message(frames):
+    """Return the response or EventList of _frames"""
+
+    if isinstance(frames, tuple):
+        response, events, complete = frames
+        return EventList(
+            ManagerMsg.from_frame(response),
+            [Event(ManagerMsg.from_frame(frame)) for frame in events],
+            Event(ManagerMsg.from_frame(complete)) if complete is not None else None,
+        )
+    return ManagerMsg.from_frame(frames)
+
+
+class Worker(ManagerActions):
+    """
+    The manager of a worker process
+
+    Callbacks are called as callback(event, worker).  Actions wait for
+    their response from the parent, a callback waiting for an action
+    delays the following events of this worker.
+    """
+
+    def __init__(self, conn, actions, index, queue_size=1000):
+        self.index = index
+        # events from the parent
+        self._conn = conn
+        # actions to the parent and their replies
+        self._actions = actions
+        self._sendlock = threading.Lock()
+        self._dispatch_table = DispatchTable()
+        self._pending = {}
+        self._seq = itertools.count()
+        self._events = queue.Queue(queue_size)
+
+    def register_event(self, event, function, headers=None):
+        """Register a callback, see Manager.register_event"""
+
+        if headers:
+            function = _HeaderFilter(function, headers)
+        self._dispatch_table = self._dispatch_table.register(event, function)
+
+    def unregister_event(self, event, function):
+        """Unregister a callback registered without headers"""
+        self._dispatch_table = self._dispatch_table.unregister(event, function)
+
+    def _request(self, kind, cdict, kwargs):
+        if not isinstance(cdict, Action):
+            cdict = dict(cdict)
+            cdict.update(kwargs)
+        seq = next(self._seq)
+        future = Future()
+        self._pending[seq] = future
+        data = pickle.dumps((kind, seq, cdict), pickle.HIGHEST_PROTOCOL)
+        with self._sendlock:
+            self._actions.send_bytes(data)
+        return future
+
+    def submit_action(self, cdict={}, **kwargs):
+        """Send an action through the parent, returns a Future"""
+        return self._request("action", cdict, kwargs)
+
+    def send_action(self, cdict={}, **kwargs):
+        """Send an action through the parent and wait for the response"""
+        return self.submit_action(cdict, **kwargs).result()
+
+    def send_list_action(self, cdict={}, **kwargs):
+        """Send a list action through the parent and wait for the EventList"""
+        return self._request("list", cdict, kwargs).result()
+
+    def _receive_events(self):
+        """Read events from the parent, waits while the queue is full"""
+
+        try:
+            while True:
+                frame = self._conn.recv_bytes()
+                if not frame:
+                    break
+                self._events.put(frame)
+        except (EOFError, OSError):
+            pass
+        finally:
+            self._events.put(None)
+
+    def _receive_replies(self):
+        """Read the replies to our actions from the parent"""
+
+        try:
+            while True:
+                seq, error, frames = pickle.loads(self._actions.recv_bytes())
+                future = self._pending.pop(seq, None)
+                if future is None or not future.set_running_or_notify_cancel():
+                    continue
+                if error is not None:
+                    future.set_exception(ManagerException(error))
+                else:
+                    future.set_result(_message(frames))
+        except (EOFError, OSError):
+            pass
+        finally:
+            for future in self._pending.values():
+                if future.set_running_or_notify_cancel():
+                    future.set_exception(ManagerException("Parent went away"))
+
+    def run(self):
+        """Dispatch events until the parent stops us"""
+
+        # replies have their own pipe, they are read while the events wait
+        for target in (self._receive_events, self._receive_replies):
+            threading.Thread(target=target, daemon=True).start()
+        events = self._events
+        while True:
+            frame = events.get()
+            if frame is None:
+                break
+            event = Event(ManagerMsg.from_frame(frame), peek_event(frame))
+            for callback in self._dispatch_table.callbacks(event.name):
+                try:
+                    if callback(event, self):
+                        break
+                except Exception:
+                    traceback.print_exc()
+
+
+def _worker_main(conn, actions, index, setup, queue_size):
+    worker = Worker(conn, actions, index, queue_size)
+    setup(worker)
+    worker.run()
+
+
+class ProcessDispatcher(object):
+    """
+    Hands the events of a Manager to worker processes, see the module
+
+    Events without a call are spread over the workers in turn.  A worker
+    buffers up to queue_size events, when it falls further behind the
+    event dispatch thread of the manager waits for it.
+    """
+
+    def __init__(self, manager, setup, workers=4, events=("*",), context=None, queue_size=1000):
+        if workers < 1:
+            raise ValueError("need at least one worker")
+        self.manager = manager
+        self.setup = setup
+        self.workers = workers
+        self.events = tuple(events)
+        self.queue_size = queue_size
+        self._context = context or multiprocessing.get_context()
+        # event pipes and action pipes of the workers, with their locks
+        self._conns = []
+        self._locks = []
+        self._actions = []
+        self._action_locks = []
+        self._processes = []
+        self._thread = None
+        self._turn = itertools.count()
+        self._closing = False
+
+    def start(self):
+        """Start the workers and forward the events"""
+
+        for index in range(self.workers):
+            receiver, sender = self._context.Pipe(duplex=False)
+            parent, child = self._context.Pipe()
+            process = self._context.Process(
+                target=_worker_main,
+                args=(receiver, child, index, self.setup, self.queue_size),
+                name="asterisk-worker-%d" % index,
+                daemon=True,
+            )
+            process.start()
+            receiver.close()
+            child.close()
+            self._conns.append(sender)
+            self._locks.append(threading.Lock())
+            self._actions.append(parent)
+            self._action_locks.append(threading.Lock())
+            self._processes.append(process)
+
+        self._thread = threading.Thread(target=self._serve_actions, name="multiproc", daemon=True)
+        self._thread.start()
+        for event in self.events:
+            self.manager.register_event(event, self._forward)
+
+    def stop(self):
+        """Stop forwarding and wait for the workers to finish their events"""
+
+        for event in self.events:
+            self.manager.unregister_event(event, self._forward)
+        self._closing = True
+        for conn, lock in zip(self._conns, self._locks):
+            with lock:
+                try:
+                    conn.send_bytes(b"")
+                except OSError:
+                    pass
+        for process in self._processes:
+            process.join()
+        for conn in self._conns + self._actions:
+            conn.close()
+        self._thread.join()
+
+    def _forward(self, event, manager):
+        key = shard_key(event)
+        if key is None:
+            index = next(self._turn) % self.workers
+        else:
+            index = hash(key) % self.workers
+        with self._locks[index]:
+            self._conns[index].send_bytes(event.message.frame)
+
+    def _serve_actions(self):
+        """Send the actions of the workers, reply with the responses"""
+
+        conns = dict((conn, index) for index, conn in enumerate(self._actions))
+        while conns:
+            for conn in multiprocessing.connection.wait(list(conns)):
+                try:
+                    kind, seq, cdict = pickle.loads(conn.recv_bytes())
+                except (EOFError, OSError):
+                    del conns[conn]
+                    continue
+                self._submit(conns[conn], kind, seq, cdict)
+
+    def _submit(self, index, kind, seq, cdict):
+        def reply(future):
+            try:
+                data = (seq, None, _frames(future.result()))
+            except ManagerException as e:
+                data = (seq, str(e), None)
+            if self._closing:
+                return
+            try:
+                with self._action_locks[index]:
+                    self._actions[index].send_bytes(pickle.dumps(data, pickle.HIGHEST_PROTOCOL))
+            except OSError:
+                pass
+
+        try:
+            if kind == "list":
+                future = self.manager.submit_list_action(cdict)
+            else:
+                future = self.manager.submit_action(cdict)
+        except ManagerException as e:
+            future = Future()
+            future.set_running_or_notify_cancel()
+            future.set_exception(e)
+        future.add_done_callback(reply)
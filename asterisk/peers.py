@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+# vim: set expandtab shiftwidth=4:
+
+"""
+Cache of the SIP peers of an asterisk
+
+A PeerCache loads all peers with one Sippeers action and keeps them
+current from PeerStatus events, so checking a peer needs no SIPshowpeer
+round trip:
+
+   import asterisk.manager
+   import asterisk.peers
+
+   manager = asterisk.manager.Manager()
+   manager.connect('host')
+   manager.login('user', 'secret')
+
+   peers = asterisk.peers.PeerCache(manager, ttl=300, maxsize=10000)
+   peers.start()
+
+   peer = peers.get('100')
+   if peer is not None and peer.reachable:
+      ...
+
+An entry not updated for ttl seconds is fetched again with SIPshowpeer
+when it is looked up.  Peers unknown to asterisk are remembered as well,
+for ttl seconds or until a PeerStatus event names them.  With maxsize the
+least recently used peers (and unknown peers) are evicted.  PeerStatus
+events handled while the peers are loaded are applied again on top of
+the loaded peers.  Registry events update the status of our own
+registrations at other servers, see registrations.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from asterisk.manager import ManagerException
+
+# statuses of peers that can be called
+_REACHABLE = ("OK", "REACHABLE", "REGISTERED", "LAGGED")
+
+
+class Peer(object):
+    """
+    A SIP peer as known to the cache
+
+    status is the status as reported by asterisk: 'OK (1 ms)',
+    'UNREACHABLE' and the like from Sippeers and SIPshowpeer, 'Reachable',
+    'Unregistered' and the like from PeerStatus events.
+    """
+
+    __slots__ = ("name", "status", "address", "port", "updated")
+
+    def __init__(self, name, status=None, address=None, port=None):
+        self.name = name
+        self.status = status
+        self.address = address
+        self.port = port
+        self.updated = time.monotonic()
+
+    @property
+    def reachable(self):
+        """Check if the status of the peer says it can be called"""
+        return self.status is not None and self.status.upper().startswith(_REACHABLE)
+
+    def __repr__(self):
+        return "<Peer %s %s>" % (self.name, self.status)
+
+
+def _strip_tech(peer):
+    """Return the peer name of 'SIP/name'"""
+    return peer.split("/", 1)[-1]
+
+
+class PeerCache(object):
+    """
+    SIP peers, loaded in bulk and kept current from manager events
+
+    ttl is the number of seconds an entry is trusted without an event,
+    None to trust it until it is evicted.  maxsize bounds the number of
+    peers, 0 for no bound.
+    """
+
+    def __init__(self, manager, ttl=300, maxsize=0):
+        self.manager = manager
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._peers = OrderedDict()
+        # when peers asterisk does not know were looked up, by name
+        self._unknown = OrderedDict()
+        # PeerStatus events handled while a refresh is in flight, with
+        # the number of refreshes
+        self._replay = []
+        self._refreshes = 0
+        # status of our registrations, by (domain, username)
+        self.registrations = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    def start(self):
+        """Register for the peer events and load all peers"""
+
+        self.manager.register_event("PeerStatus", self._handle_peer_status)
+        self.manager.register_event("Registry", self._handle_registry)
+        self.manager.register_event("FullyBooted", self._handle_booted)
+        return self.refresh().result()
+
+    def stop(self):
+        """Unregister from the manager, the cache is no longer updated"""
+
+        self.manager.unregister_event("PeerStatus", self._handle_peer_status)
+        self.manager.unregister_event("Registry", self._handle_registry)
+        self.manager.unregister_event("FullyBooted", self._handle_booted)
+
+    def refresh(self):
+        """
+        Reload all peers with Sippeers
+
+        Returns a concurrent.futures.Future that receives the number of
+        peers once the cache is replaced.
+        """
+
+        # record the events from before the list is sent
+        with self._lock:
+            self._refreshes += 1
+        result = Future()
+        result.set_running_or_notify_cancel()
+
+        def loaded(future):
+            try:
+                peers = future.result()
+            except ManagerException as e:
+                self._load(None)
+                result.set_exception(e)
+                return
+            if peers.get_header("Response") == "Error":
+                self._load(None)
+                result.set_exception(ManagerException(peers.get_header("Message")))
+                return
+            result.set_result(self._load(peers))
+
+        try:
+            future = self.manager.submit_list_action({"Action": "Sippeers"})
+        except ManagerException as e:
+            self._load(None)
+            result.set_exception(e)
+            return result
+        future.add_done_callback(loaded)
+        return result
+
+    def _load(self, peers):
+        """
+        Replace the cache by the peers of a Sippeers list, None when the
+        refresh failed, and apply the recorded events again
+        """
+
+        with self._lock:
+            replay = self._replay
+            self._refreshes -= 1
+            if not self._refreshes:
+                self._replay = []
+            if peers is None:
+                return None
+            self._peers.clear()
+            self._unknown.clear()
+            for event in peers:
+                headers = event.headers
+                name = headers.get("ObjectName")
+                if name is None:
+                    continue
+                self._store(Peer(name, headers.get("Status"), headers.get("IPaddress"), headers.get("IPport")))
+            # the events were handled before the list was complete, the
+            # peers may be older than them
+            for headers in replay:
+                self._peer_status(headers)
+            return len(self._peers)
+
+    def invalidate(self, name=None):
+        """Forget a peer, or all peers when no name is given"""
+
+        with self._lock:
+            if name is None:
+                self._peers.clear()
+                self._unknown.clear()
+            else:
+                self._peers.pop(name, None)
+                self._unknown.pop(name, None)
+
+    def get(self, name, fetch=True):
+        """
+        Return a peer, None if asterisk does not know it
+
+        A missing or expired entry is fetched with SIPshowpeer, unless
+        fetch is False.  A peer found unknown within ttl seconds is not
+        fetched again.
+        """
+
+        with self._lock:
+            peer = self._peers.get(name)
+            if peer is not None and not self._expired(peer.updated):
+                self._peers.move_to_end(name)
+                self.hits += 1
+                return peer
+            checked = self._unknown.get(name)
+            if peer is None and checked is not None and not self._expired(checked):
+                self.hits += 1
+                return None
+            self.misses += 1
+        if not fetch:
+            return None
+        return self.fetch(name)
+
+    def fetch(self, name):
+        """Fetch a peer with SIPshowpeer and cache it"""
+
+        response = self.manager.sipshowpeer(name)
+        if response.get_header("Response") != "Success":
+            with self._lock:
+                self._peers.pop(name, None)
+                self._unknown[name] = time.monotonic()
+                self._unknown.move_to_end(name)
+                if self.maxsize and len(self._unknown) > self.maxsize:
+                    self._unknown.popitem(last=False)
+            return None
+        peer = Peer(
+            name,
+            response.get_header("Status"),
+            response.get_header("Address-IP"),
+            response.get_header("Address-Port"),
+        )
+        with self._lock:
+            self._store(peer)
+        return peer
+
+    def peers(self):
+        """Return the list of the cached peers"""
+        with self._lock:
+            return list(self._peers.values())
+
+    def __len__(self):
+        return len(self._peers)
+
+    def __contains__(self, name):
+        return name in self._peers
+
+    # called with the lock held
+
+    def _expired(self, updated):
+        return self.ttl is not None and time.monotonic() - updated > self.ttl
+
+    def _store(self, peer):
+        self._unknown.pop(peer.name, None)
+        self._peers[peer.name] = peer
+        self._peers.move_to_end(peer.name)
+        if self.maxsize and len(self._peers) > self.maxsize:
+            self._peers.popitem(last=False)
+
+    def _peer_status(self, headers):
+        name = _strip_tech(headers.get("Peer", ""))
+        address = headers.get("Address")
+        peer = self._peers.get(name)
+        if peer is None:
+            peer = Peer(name)
+        peer.status = headers.get("PeerStatus")
+        if address:
+            # Address is ip:port
+            peer.address, _, peer.port = address.rpartition(":")
+        peer.updated = time.monotonic()
+        self._store(peer)
+
+    # event handlers
+
+    def _handle_peer_status(self, event, manager):
+        headers = event.headers
+        with self._lock:
+            self._peer_status(headers)
+            if self._refreshes:
+                self._replay.append(headers)
+
+    def _handle_registry(self, event, manager):
+        headers = event.headers
+        key = (headers.get("Domain"), headers.get("Username"))
+        self.registrations[key] = headers.get("Status")
+
+    def _handle_booted(self, event, manager):
+        # a new session, we may have missed events
+        self.refresh()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# vim: set expandtab shiftwidth=4:
+
+"""
+Recording and replaying manager traffic
+
+A Recorder writes the frames received by a Manager to a file, with the
+time they arrived.  A Replayer feeds a recording to the event callbacks
+of a Manager, or any other function taking an event, to reproduce
+production traffic offline:
+
+   import asterisk.manager
+   import asterisk.recorder
+
+   manager = asterisk.manager.Manager()
+   manager.recorder = asterisk.recorder.Recorder('ami.rec')
+   manager.connect('host')
+   ...
+   manager.close()
+   manager.recorder.close()
+
+   # later, with the callbacks to test registered on a Manager that is
+   # not connected:
+   replayer = asterisk.recorder.Replayer('ami.rec')
+   print(replayer.replay(manager, speed=10))
+
+Frames are recorded as received, before events nobody registered for are
+dropped.  The file starts with MAGIC, each record is a header of the
+receive time (seconds since the epoch, double) and the frame length
+(unsigned int), both big-endian, followed by the frame.  Recordings are
+appended to.
+"""
+
+import struct
+import threading
+import time
+
+from asterisk.framing import peek_event
+from asterisk.manager import Event, ManagerMsg
+
+MAGIC = b"PYSTAMI1"
+RECORD = struct.Struct(">dI")
+
+
+class Recorder(object):
+    """
+    Appends received frames to a recording
+
+    Set it as the recorder of a Manager, write is called by the reading
+    thread.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "ab")
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+        self.frames = 0
+
+    def write(self, frame, timestamp=None):
+        """Record a frame"""
+
+        if timestamp is None:
+            timestamp = time.time()
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(RECORD.pack(timestamp, len(frame)))
+            self._file.write(frame)
+            self.frames += 1
+
+    def flush(self):
+        """Write buffered records to the file"""
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+
+    def close(self):
+        """Close the recording, later frames are not recorded"""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def read_recording(path):
+    """Iterate over the (timestamp, frame) records of a recording"""
+
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("%s is not a manager recording" % path)
+        while True:
+            header = f.read(RECORD.size)
+            if len(header) < RECORD.size:
+                # end, or a record cut short by a crash
+                break
+            timestamp, length = RECORD.unpack(header)
+            frame = f.read(length)
+            if len(frame) < length:
+                break
+            yield timestamp, frame
+
+
+class Replayer(object):
+    """
+    Feeds the events of a recording to event callbacks
+
+    speed scales the time between events: 1 replays at the original
+    speed, 10 ten times faster, None as fast as possible.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def events(self):
+        """Iterate over the (timestamp, event) pairs of the recording"""
+
+        for timestamp, frame in read_recording(self.path):
+            name = peek_event(frame)
+            if name is not None:
+                yield timestamp, Event(ManagerMsg.from_frame(frame), name)
+
+    def replay(self, target, speed=None):
+        """
+        Replay the events to target and return statistics
+
+        target is a Manager, its registered callbacks are run like the
+        event dispatch thread does, or a function called with each event.
+        Events are dispatched on the calling thread.  The statistics are
+        a dictionary of the event count, the elapsed seconds, events per
+        second and the dispatch latency in seconds (mean, 50th and 99th
+        percentile, maximum).
+        """
+
+        if callable(target):
+            dispatch = target
+        else:
+            dispatch = target._dispatch_event
+
+        latencies = []
+        first = None
+        start = time.perf_counter()
+        for timestamp, event in self.events():
+            if speed:
+                if first is None:
+                    first = timestamp
+                delay = (timestamp - first) / speed - (time.perf_counter() - start)
+                if delay > 0:
+                    time.sleep(delay)
+            t = time.perf_counter()
+            dispatch(event)
+            latencies.append(time.perf_counter() - t)
+        elapsed = time.perf_counter() - start
+
+        latencies.sort()
+        count = len(latencies)
+        stats = {
+            "events": count,
+            "elapsed": elapsed,
+            "events_per_sec": count / elapsed if elapsed > 0 else 0.0,
+        }
+        if count:
+            stats["latency"] = {
+                "mean": sum(latencies) / count,
+                "p50": latencies[count // 2],
+                "p99": latencies[min(count - 1, count * 99 // 100)],
+                "max": latencies[-1],
+            }
+        return stats
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+"""
+Benchmarks of asterisk.manager.Manager against the fake manager server
+
+Measures sequential, pipelined and batched actions per second, the
+response latency percentiles and the number of events per second the
+Manager dispatches when flooded.  Run from the top directory:
+
+   python benchmarks/bench_manager.py --actions 20000 --events 200000
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import asterisk.fakeserver  # noqa: E402
+import asterisk.manager  # noqa: E402
+
+
+def percentiles(values):
+    values = sorted(values)
+    n = len(values)
+    return dict(
+        (name, values[min(n - 1, n * p // 100)] * 1000.0)
+        for name, p in (("p50", 50), ("p90", 90), ("p99", 99), ("max", 100))
+    )
+
+
+def report(name, count, elapsed, latencies=None):
+    line = "%-24s %10.0f/s" % (name, count / elapsed)
+    if latencies:
+        line += "  " + "  ".join("%s %.3fms" % item for item in percentiles(latencies).items())
+    print(line)
+
+
+def connect(address, **kwargs):
+    manager = asterisk.manager.Manager(**kwargs)
+    manager.connect(*address)
+    manager.login("user", "secret")
+    return manager
+
+
+def bench_sequential(address, count):
+    manager = connect(address)
+    latencies = []
+    start = time.perf_counter()
+    for i in range(count):
+        t = time.perf_counter()
+        manager.ping()
+        latencies.append(time.perf_counter() - t)
+    report("ping sequential", count, time.perf_counter() - start, latencies)
+    manager.close()
+
+
+def bench_pipelined(address, count, window):
+    manager = connect(address)
+    latencies = []
+    sent = {}
+    done = threading.Semaphore(window)
+
+    def finished(future):
+        latencies.append(time.perf_counter() - sent.pop(future))
+        done.release()
+
+    start = time.perf_counter()
+    for i in range(count):
+        done.acquire()
+        t = time.perf_counter()
+        future = manager.submit_action({"Action": "Ping"})
+        sent[future] = t
+        future.add_done_callback(finished)
+    for i in range(window):
+        done.acquire()
+    report("ping pipelined (%d)" % window, count, time.perf_counter() - start, latencies)
+    manager.close()
+
+
+def bench_batched(address, count, size):
+    manager = connect(address)
+    start = time.perf_counter()
+    for i in range(0, count, size):
+        manager.send_actions([{"Action": "Ping"}] * min(size, count - i))
+    report("ping batched (%d)" % size, count, time.perf_counter() - start)
+    manager.close()
+
+
+def bench_events(server, count, **kwargs):
+    manager = connect(server.address, **kwargs)
+    received = [0]
+    finished = threading.Event()
+
+    def handle_event(event, manager):
+        received[0] += 1
+        if received[0] == count:
+            finished.set()
+
+    manager.register_event("VarSet", handle_event)
+    start = time.perf_counter()
+    server.flood(count)
+    finished.wait()
+    options = ", ".join("%s=%s" % item for item in sorted(kwargs.items()))
+    report("events %s" % (options or "default"), count, time.perf_counter() - start)
+    manager.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--actions", type=int, default=10000)
+    parser.add_argument("--events", type=int, default=100000)
+    parser.add_argument("--window", type=int, default=100, help="actions in flight when pipelined")
+    parser.add_argument("--batch", type=int, default=500, help="actions per send_actions")
+    args = parser.parse_args()
+
+    server = asterisk.fakeserver.FakeAMIServer()
+    address = server.start()
+
+    bench_sequential(address, args.actions)
+    bench_pipelined(address, args.actions, args.window)
+    bench_batched(address, args.actions, args.batch)
+    bench_events(server, args.events)
+    bench_events(server, args.events, dispatch_workers=4)
+
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()